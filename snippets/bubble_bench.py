@@ -9,7 +9,8 @@
 ./bubble_bench.py -c config.json &
 
 压力测试报告将生成在 bubble_bench_report.html ，打开文件即是压力测试的 ECharts 图表。因为渲染图表需要
-下载 echarts js，所以需要联网。
+下载 echarts js，所以需要联网。在无法联网的压测机上，可以用 --echarts-js 把本地的 echarts.min.js 内联到报告中：
+./bubble_bench.py -g --echarts-js /path/to/echarts.min.js
 
 如果压测环境允许对不同的 endpoint 并行发压，可以传入并行发压参数 -j ：
 ./bubble_bench.py -c config.json -j 3 &
@@ -23,21 +24,55 @@
 ./bubble_bench.py -g
 
 在压测执行过程中，也可以随时通过 ./bubble_bench.py -g 生成基于当前压测结果的部分结果报告。
+或者加上 --live 参数启动实时报告服务，在浏览器中打开 http://localhost:8000/ 查看随压测进度自动更新的报告：
+./bubble_bench.py -c config.json --live 8000 &
+./bubble_bench.py -g --live 8000
+
+默认每个压测 case 都会启动一次 sglang.bench_serving 子进程，每次都要重新 import torch、加载 tokenizer 和数据集。
+在配置中设置 "client": "builtin" 可以改用内置的 asyncio 压测客户端，每个 endpoint 只加载一次 tokenizer 和数据集，
+结果字段与 sglang.bench_serving 一致。
+
+每个压测 case 的结果还会追加写入 "result_db" 配置的 SQLite 数据库（默认 bubble_bench.db，只追加不删除），
+按 endpoint、配置 hash、服务端版本和时间建索引。压测后可以与历史基线对比，有显著的吞吐或延迟回退时以返回码 1 退出：
+./bubble_bench.py -c config.json --compare previous    # 与同一配置的上一次压测对比
+./bubble_bench.py -g -c config.json --compare 0.4.6    # 不压测，与服务端版本为 0.4.6 的历史压测对比
+
+配置 "workload_matrix" 可以对每个 endpoint 压测输入长度、输出长度、共享前缀比例和数据集的所有组合，
+每个组合的结果保存为 {endpoint}@{组合名}.bench，报告中按组合对比各 endpoint 在 prefill-heavy 和 decode-heavy 负载下的表现。
+
+单台发压机的 CPU 或网卡成为瓶颈时，可以配置 "distributed" 将每个 case 的负载分给多个 worker 进程（可以在多台机器上）。
+在每台发压机上启动 worker：
+./bubble_bench.py --worker 0.0.0.0:7000
 """
 
+import asyncio
+import base64
 import glob
+import hashlib
+import itertools
 import json
+import math
 import os
+import random
 import re
+import sqlite3
 import subprocess
+import sys
+import threading
+import time
 from argparse import ArgumentParser
 from collections import defaultdict
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Event, Pool, Process
+from multiprocessing.connection import Client, Listener
+from statistics import NormalDist
 
-import pandas as pd
+import numpy as np
 import requests
-from torch.utils import collect_env
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 # 默认配置
 DEFAULT_CONFIG_JSON = """{
@@ -48,6 +83,83 @@ DEFAULT_CONFIG_JSON = """{
         "--random-input-len 2300 --random-output-len 700"
     ],
     "api_key": null,
+    // client：压测客户端。"sglang" 对每个压测 case 启动一次 sglang.bench_serving 子进程；
+    // "builtin" 使用内置的 asyncio 流式客户端，每个 endpoint 只加载一次 tokenizer 和数据集，在进程内完成所有并发的压测
+    "client": "sglang",
+    // builtin_client：内置客户端的压测参数，含义与 sglang_bench_cmd 中的同名参数一致
+    "builtin_client": {
+        // 请求中的模型名，不提供时从 endpoint 的 /v1/models 获取
+        "model": null,
+        "tokenizer": "/workspace/DeepSeek-R1",
+        "dataset_path": "/workspace/ShareGPT_Vicuna_unfiltered/ShareGPT_V3_unfiltered_cleaned_split.json",
+        // dataset_name："random" 将数据集中的 prompt 重复并截断到 random_input_len；"sharegpt" 使用数据集中 prompt 的原始长度
+        "dataset_name": "random",
+        "random_input_len": 2300,
+        "random_output_len": 700,
+        // prefix_ratio：所有请求共享的前缀占 random_input_len 的比例，用于压测 prefix cache 命中时的性能
+        "prefix_ratio": 0,
+        "seed": 1
+    },
+    // workload_matrix：负载矩阵，可选，对每个 endpoint 压测各轴取值的笛卡尔积，每个组合作为一个名为 {endpoint}@{组合} 的
+    // endpoint 单独保存结果，例如 MODEL-NAME.TP4@in256-out64。轴为 input_len、output_len、prefix_ratio（共享前缀比例，
+    // 仅支持 builtin 客户端）、dataset（"random" 或 "sharegpt"，sharegpt 不使用 input_len），未配置的轴取 builtin_client
+    // 或 sglang_bench_cmd 中的值。同一 endpoint 的各组合依次压测，-j 在不同 endpoint 之间并行。报告中会按负载对比各 endpoint，
+    // 从 decode-heavy 到 prefill-heavy 排列。例如：
+    // "workload_matrix": {"input_len": [256, 2300], "output_len": [64, 700], "prefix_ratio": [0, 0.5], "dataset": ["random"]},
+    "workload_matrix": null,
+    // adaptive：自适应并发扫描，可选，配置后不再遍历 concurs/repeats。从 min_concurrency 开始倍增并发（每个并发重复 repeat 次），
+    // 直到违反 slo（键为压测结果字段，值为上限）或吞吐增长低于 plateau_ratio，再在拐点附近二分细化 refine_steps 次，
+    // 最终报告每个 endpoint 满足 SLO 的最大 QPS/GPU。例如：
+    // "adaptive": {"slo": {"p99_ttft_ms": 3000, "mean_itl_ms": 50}, "min_concurrency": 1, "max_concurrency": 256,
+    //              "plateau_ratio": 0.03, "refine_steps": 3, "repeat": 5},
+    "adaptive": null,
+    // early_stop：按置信区间提前结束每个并发的压测，可选，仅支持 builtin 客户端，配置后忽略 repeats。每个并发每批发送
+    // 并发数 x batch_repeat 个请求，直到吞吐、p99 ITL、p99 TTFT 的置信区间（置信度 confidence）相对宽度都不超过 rel_ci_width，
+    // 请求数至少 min_requests、至多 max_requests，并且至少 3 批。报告中会展示置信区间。p99 的置信区间需要足够多的样本才有上界
+    // （置信度 0.95 时约 600 个），样本不足时区间记为 null，p99 不参与判断：p99 TTFT 每个请求一个样本，请求数不到约 600 时
+    // 只按吞吐（和样本已足够的 p99 ITL）提前结束，要收敛 p99 TTFT 需要把 min_requests 设为 600 以上，低并发时压测耗时会明显变长。例如：
+    // "early_stop": {"confidence": 0.95, "rel_ci_width": 0.05, "min_requests": 64, "max_requests": 4000, "batch_repeat": 2},
+    "early_stop": null,
+    // warmup_requests：每个 endpoint 正式压测前发送的预热请求数，结果丢弃不计入 .bench，用于填充 prefix cache、
+    // 预热 CUDA graph 和各级缓存。预热并发取压测的最大并发与 warmup_requests 中的较小值
+    "warmup_requests": 0,
+    // steady_state：稳态测量窗口，可选，仅支持 builtin 客户端。每个 case 去掉开头 trim_head、结尾 trim_tail 比例时长的
+    // 爬坡和收尾阶段，延迟只统计窗口内发出的请求，吞吐按窗口内完成的请求数除以窗口时长计算。例如：
+    // "steady_state": {"trim_head": 0.1, "trim_tail": 0.1},
+    "steady_state": null,
+    // distributed：分布式发压，可选，仅支持 builtin 客户端。每个 case 的并发和请求数均分给各个 worker，worker 同步开始发压，
+    // 由本进程合并所有 worker 的单请求样本计算精确的分位数。workers 是 worker 地址列表（各发压机上需要有相同路径的 tokenizer
+    // 和数据集，并且时钟经过 NTP 同步），也可以是一个整数，表示在本机启动多少个 worker 进程。
+    // authkey 需要与 worker 的 --authkey 一致，start_delay 是从下发开始指令到各 worker 同时开始发压的等待秒数。例如：
+    // "distributed": {"workers": ["10.0.0.2:7000", "10.0.0.3:7000"], "authkey": "bubble_bench", "start_delay": 0.5},
+    "distributed": null,
+    // raw_samples：保存每个请求的 TTFT、ITL、E2E 原始样本到 {endpoint}-{并发}.npz，报告据此计算任意分位数、CDF 和直方图。
+    // builtin 客户端总是保存，不受此项影响；sglang 客户端开启后会给 sglang.bench_serving 传 --output-details，
+    // 需要支持该参数的较新版本 sglang（旧版本会因参数错误中止压测），默认关闭
+    "raw_samples": false,
+    // open_loop：开环压测，可选，配置后按请求到达率 qps 扫描，不再遍历 concurs/repeats。每个 qps 发送 duration 秒的请求，
+    // max_concurrency 为在途请求数上限（null 为不限）。arrival 为到达过程："poisson"；"gamma"，间隔服从形状参数为 burstiness 的
+    // gamma 分布，burstiness 小于 1 时比泊松到达更突发；"trace"，按 trace_path 中的时间戳回放并缩放到 qps（仅支持 builtin 客户端，
+    // 文件为 JSON Lines，每行是一个秒级时间戳或带 timestamp 字段的对象）。goodput_slo 为单请求的 SLO（ttft_ms、tpot_ms、e2e_ms
+    // 上限），满足 SLO 的请求吞吐即 goodput，需要 raw_samples。例如：
+    // "open_loop": {"qps": [1, 2, 4, 8, 16], "duration": 60, "max_concurrency": null, "arrival": "gamma", "burstiness": 0.5,
+    //               "trace_path": null, "goodput_slo": {"ttft_ms": 3000, "tpot_ms": 50}},
+    "open_loop": null,
+    // server_metrics：压测每个 case 期间按 interval 秒轮询 endpoint 的 Prometheus /metrics（sglang 需要以 --enable-metrics 启动），
+    // 时间序列追加写入 {endpoint}.metrics.jsonl，报告中把各 case 的排队请求数、KV cache 占用率等与 P99 TTFT 画在一起，
+    // 用于定位延迟拐点是 KV cache 饱和还是调度排队导致的。metrics 为采集的指标名，不提供时采集 sglang 的运行请求数、
+    // 排队请求数、token（KV cache）占用率、prefix cache 命中率和生成吞吐。同名指标有多组 label（如多个 DP rank）时，
+    // num_ 开头的计数类指标求和，其余取平均。例如：
+    // "server_metrics": {"interval": 1.0, "metrics": ["sglang:num_running_reqs", "sglang:num_queue_reqs", "sglang:token_usage"]},
+    "server_metrics": null,
+    // result_db：追加写入每个压测 case 结果的 SQLite 数据库，保存所有历史压测，用于 --compare 对比回退，null 为不保存。
+    // regression：--compare 的判定参数，在 alpha 显著性水平下差异显著，并且变差超过 min_change 比例时判定为回退
+    "result_db": "bubble_bench.db",
+    "regression": {"alpha": 0.05, "min_change": 0.05},
+    // report_percentiles：报告中根据原始样本计算的 TTFT、ITL 分位数
+    "report_percentiles": [50, 90, 99, 99.9],
+    // report_max_points：报告中每条折线（CDF、服务端指标时间序列等）最多保留的点数，超过时用 LTTB 算法降采样
+    "report_max_points": 1000,
     // concurs：最大并发数：每个最大并发代表一次 benchmark
     // repeats：并发重复次数：与最大并发数相乘等于每次推理的总样本数。repeats 可以是单个数值，比如 10，或者一个列表。
     // 当它是一个列表时，列表大小必须与 "concurs" 完全一致，代表对应于每个并发的重复次数。
@@ -86,164 +198,2601 @@ def get_endpoint_name(endpoint):
     return endpoint_name
 
 
-def benchmark_one(sglang_bench_cmd, endpoint, concurrency, repeat, verbose=False):
-    num_prompt = concurrency * repeat
-    base_url = endpoint["base_url"]
-    endpoint_name = get_endpoint_name(endpoint)
-    throughput_scale = (
-        endpoint["throughput_scale"] if "throughput_scale" in endpoint else 1.0
-    )
-    output_file = f"{endpoint_name}.bench"
-    log_file = f"{endpoint_name}.log"
-    tmp_file = f"{endpoint_name}-{concurrency}.bench"
-    if os.path.isfile(tmp_file):
-        os.remove(tmp_file)
-    # Construct command
-    cmd = " ".join(
-        [
-            *sglang_bench_cmd,
-            "--base-url",
-            base_url,
-            "--request-rate",
-            str(concurrency),
-            "--max-concurrency",
-            str(concurrency),
-            "--num-prompt",
-            str(num_prompt),
-            "--output-file",
-            tmp_file,
-        ]
-    )
-    if verbose:
-        print(f"{cmd}")
-    # Execute command
-    with open(log_file, "a") as f:
-        subprocess.run(cmd, check=True, shell=True, stdout=f)
-    with open(tmp_file, "r") as f:
-        result = json.load(f)
-    with open(output_file, "a") as f:
-        result["_throughput_scale"] = throughput_scale
-        result["_endpoint_name"] = endpoint_name
-        json.dump(result, f)
-        f.write("\n")
-    if os.path.isfile(tmp_file):
-        os.remove(tmp_file)
+def benchmark_one(
+    sglang_bench_cmd,
+    endpoint,
+    concurrency,
+    repeat,
+    verbose=False,
+    save=True,
+    raw_samples=False,
+    open_loop_case=None,
+):
+    base_url = endpoint["base_url"]
+    endpoint_name = get_endpoint_name(endpoint)
+    log_file = f"{endpoint_name}.log"
+    if open_loop_case:
+        # 开环压测：按 qps 到达，concurrency 为在途请求上限，None 为不限
+        num_prompt = open_loop_case["num_prompt"]
+        tmp_file = f"{endpoint_name}-qps{open_loop_case['qps']}.bench.tmp"
+        rate_args = ["--request-rate", str(open_loop_case["qps"])]
+        if concurrency:
+            rate_args += ["--max-concurrency", str(concurrency)]
+        if open_loop_case["arrival"] == "gamma":
+            rate_args += ["--burstiness", str(open_loop_case["burstiness"])]
+    else:
+        num_prompt = concurrency * repeat
+        tmp_file = f"{endpoint_name}-{concurrency}.bench.tmp"
+        rate_args = [
+            "--request-rate",
+            str(concurrency),
+            "--max-concurrency",
+            str(concurrency),
+        ]
+    if os.path.isfile(tmp_file):
+        os.remove(tmp_file)
+    # Construct command
+    cmd = " ".join(
+        [
+            *sglang_bench_cmd,
+            "--base-url",
+            base_url,
+            *rate_args,
+            "--num-prompt",
+            str(num_prompt),
+            "--output-file",
+            tmp_file,
+            *(["--output-details"] if raw_samples else []),
+        ]
+    )
+    if verbose:
+        print(f"{cmd}")
+    # Execute command
+    with open(log_file, "a") as f:
+        subprocess.run(cmd, check=True, shell=True, stdout=f)
+    with open(tmp_file, "r") as f:
+        result = json.load(f)
+    if raw_samples:
+        # 单请求明细很大，从结果中拿出来单独存为 .npz
+        details = {
+            key: result.pop(key, [])
+            for key in [
+                "input_lens",
+                "output_lens",
+                "ttfts",
+                "itls",
+                "generated_texts",
+                "errors",
+            ]
+        }
+        ok = [i for i, error in enumerate(details["errors"]) if not error]
+        ttfts = [details["ttfts"][i] for i in ok]
+        itls = [details["itls"][i] for i in ok]
+        e2es = [details["ttfts"][i] + sum(details["itls"][i]) for i in ok]
+        output_lens = [details["output_lens"][i] for i in ok]
+    if open_loop_case:
+        result["offered_qps"] = open_loop_case["qps"]
+        result["arrival"] = open_loop_case["arrival"]
+        if open_loop_case.get("goodput_slo") and raw_samples:
+            result["goodput"] = calc_goodput(
+                ttfts,
+                e2es,
+                output_lens,
+                result["duration"],
+                open_loop_case["goodput_slo"],
+            )
+    if raw_samples and save:
+        save_samples(
+            endpoint,
+            result,
+            ttfts,
+            itls,
+            e2es,
+            [details["input_lens"][i] for i in ok],
+            output_lens,
+        )
+    if save:
+        save_result(endpoint, result)
+    if os.path.isfile(tmp_file):
+        os.remove(tmp_file)
+    return result
+
+
+def save_result(endpoint, result):
+    """将一个压测 case 的结果追加写入 {endpoint_name}.bench"""
+    endpoint_name = get_endpoint_name(endpoint)
+    result["_throughput_scale"] = endpoint.get("throughput_scale", 1.0)
+    result["_endpoint_name"] = endpoint_name
+    if "_cell" in endpoint:
+        # 负载矩阵的组合，报告据此按负载对比各 endpoint
+        result["_endpoint_base"] = endpoint["_endpoint_base"]
+        result["_workload"] = endpoint["_cell"]
+    with open(f"{endpoint_name}.bench", "a") as f:
+        json.dump(result, f)
+        f.write("\n")
+
+
+def save_samples(endpoint, result, ttfts, itls, e2es, input_lens, output_lens):
+    """将一个压测 case 的单请求样本（秒）存为列式的 {endpoint_name}-{并发}.npz，文件名记录在结果的 _samples_file 中。
+    所有请求的 ITL 展平成一列，第 i 个请求的 ITL 为 itl_ms[itl_offsets[i]:itl_offsets[i + 1]]"""
+    case_name = (
+        f"qps{result['offered_qps']}"
+        if "offered_qps" in result
+        else result["max_concurrency"]
+    )
+    samples_file = f"{get_endpoint_name(endpoint)}-{case_name}.npz"
+    np.savez_compressed(
+        samples_file,
+        ttft_ms=np.asarray(ttfts, dtype=np.float32) * 1000,
+        e2e_ms=np.asarray(e2es, dtype=np.float32) * 1000,
+        itl_ms=np.asarray(
+            [itl for request_itls in itls for itl in request_itls], dtype=np.float32
+        )
+        * 1000,
+        itl_offsets=np.cumsum([0] + [len(request_itls) for request_itls in itls]),
+        input_len=np.asarray(input_lens, dtype=np.int32),
+        output_len=np.asarray(output_lens, dtype=np.int32),
+    )
+    result["_samples_file"] = samples_file
+
+
+def load_builtin_workload(client_config):
+    """加载内置客户端的 tokenizer 和数据集，每个 endpoint 进程只加载一次"""
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        client_config["tokenizer"], trust_remote_code=True
+    )
+    texts = []
+    dataset_path = client_config.get("dataset_path")
+    if dataset_path:
+        with open(dataset_path, "r", encoding="utf-8") as f:
+            dataset = json.load(f)
+        texts = [
+            data["conversations"][0]["value"]
+            for data in dataset
+            if len(data.get("conversations", [])) > 0
+        ]
+    # texts 只在被采样到时才 tokenize，避免每次启动都 tokenize 整个数据集
+    return {"tokenizer": tokenizer, "texts": texts, "token_ids": {}}
+
+
+def sample_builtin_prompts(
+    workload, num_prompt, input_len, seed, dataset="random", prefix_len=0
+):
+    """采样 prompt，返回 (prompt 列表, 每个 prompt 的 token 数)。
+    dataset 为 "random" 时与 sglang.bench_serving 的 random 数据集一致：采样数据集中的 prompt，重复并截断到 input_len 个 token；
+    为 "sharegpt" 时使用数据集中 prompt 的原始长度。prefix_len 大于 0 时所有请求以同一段 prefix_len 个 token 的共享前缀开头，
+    random 数据集的 prompt 总长度仍为 input_len"""
+    tokenizer = workload["tokenizer"]
+    texts = workload["texts"]
+    rng = random.Random(seed)
+
+    def text_token_ids(i):
+        if i not in workload["token_ids"]:
+            workload["token_ids"][i] = tokenizer.encode(
+                texts[i], add_special_tokens=False
+            ) or [0]
+        return workload["token_ids"][i]
+
+    prefix_ids = []
+    if prefix_len > 0:
+        # 共享前缀与 seed 无关，同一 endpoint 的所有 case 使用同一段前缀，与真实场景中的 system prompt 一样可以命中 prefix cache
+        prefix_rng = random.Random(prefix_len)
+        if texts:
+            token_ids = text_token_ids(prefix_rng.randrange(len(texts)))
+            prefix_ids = (token_ids * (prefix_len // len(token_ids) + 1))[:prefix_len]
+        else:
+            prefix_ids = [
+                prefix_rng.randrange(tokenizer.vocab_size) for _ in range(prefix_len)
+            ]
+    suffix_len = max(input_len - len(prefix_ids), 0)
+    prompts = []
+    input_lens = []
+    for _ in range(num_prompt):
+        if texts:
+            token_ids = text_token_ids(rng.randrange(len(texts)))
+            if dataset == "random":
+                token_ids = (token_ids * (suffix_len // len(token_ids) + 1))[
+                    :suffix_len
+                ]
+        else:
+            token_ids = [rng.randrange(tokenizer.vocab_size) for _ in range(suffix_len)]
+        token_ids = prefix_ids + token_ids
+        prompts.append(tokenizer.decode(token_ids))
+        input_lens.append(len(token_ids))
+    return prompts, input_lens
+
+
+def build_builtin_payloads(
+    workload,
+    model,
+    num_prompt,
+    input_len,
+    output_len,
+    seed,
+    dataset="random",
+    prefix_len=0,
+):
+    """构造内置客户端的流式 completions 请求体，返回 (请求体列表, 每个请求的输入 token 数)"""
+    prompts, input_lens = sample_builtin_prompts(
+        workload, num_prompt, input_len, seed, dataset, prefix_len
+    )
+    payloads = [
+        {
+            "model": model,
+            "prompt": prompt,
+            "temperature": 0.0,
+            "max_tokens": output_len,
+            "ignore_eos": True,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        for prompt in prompts
+    ]
+    return payloads, input_lens
+
+
+async def builtin_request(session, url, headers, payload):
+    """发送一个 OpenAI 兼容的流式 completions 请求，记录单个请求的 TTFT、ITL 和 E2E 延迟"""
+    import aiohttp
+
+    output = {"success": False, "ttft": 0.0, "itls": [], "e2e": 0.0, "output_len": 0}
+    generated_text = []
+    st = time.perf_counter()
+    output["start"] = st
+    most_recent_timestamp = st
+    try:
+        async with session.post(url, json=payload, headers=headers) as res:
+            if res.status != 200:
+                output["error"] = f"{res.status} {res.reason}"
+                return output
+            async for line in res.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:") :].strip()
+                if data == b"[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    output["output_len"] = chunk["usage"]["completion_tokens"]
+                if chunk.get("choices") and chunk["choices"][0].get("text"):
+                    timestamp = time.perf_counter()
+                    if not generated_text:
+                        output["ttft"] = timestamp - st
+                    else:
+                        output["itls"].append(timestamp - most_recent_timestamp)
+                    most_recent_timestamp = timestamp
+                    generated_text.append(chunk["choices"][0]["text"])
+        output["e2e"] = time.perf_counter() - st
+        output["generated_text"] = "".join(generated_text)
+        output["success"] = True
+    except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+        output["error"] = repr(e)
+    return output
+
+
+def load_trace(trace_path):
+    """读取 trace 中请求的到达时间戳（秒），JSON Lines 格式，每行是一个时间戳或带 timestamp 字段的对象"""
+    timestamps = []
+    with open(trace_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                timestamps.append(
+                    record["timestamp"] if isinstance(record, dict) else record
+                )
+    assert len(timestamps) > 1, f"Need at least 2 timestamps in trace {trace_path}"
+    return np.sort(np.asarray(timestamps, dtype=float))
+
+
+def arrival_times(
+    num_prompt, request_rate, arrival="poisson", burstiness=1.0, trace=None
+):
+    """生成 num_prompt 个请求相对发压开始的到达时间（秒），平均到达率为 request_rate。
+    poisson 为指数分布的到达间隔；gamma 为形状参数 burstiness 的 gamma 分布间隔，与 sglang.bench_serving 的
+    --burstiness 一致；trace 按 trace 时间戳的间隔回放并整体缩放到 request_rate，trace 不够长时循环回放"""
+    if num_prompt == 0 or request_rate == float("inf"):
+        return np.zeros(num_prompt)
+    if arrival == "trace":
+        intervals = np.diff(trace)
+        intervals = np.resize(intervals, num_prompt) / (intervals.mean() * request_rate)
+    elif arrival == "gamma":
+        intervals = np.random.gamma(
+            burstiness, 1.0 / (request_rate * burstiness), num_prompt
+        )
+    else:
+        intervals = np.random.exponential(1.0 / request_rate, num_prompt)
+    return np.concatenate([[0.0], np.cumsum(intervals[:-1])])
+
+
+async def builtin_run_case(base_url, headers, payloads, concurrency, arrivals):
+    """在 arrivals（相对发压开始的秒数）时刻发送请求，同时最多 concurrency 个请求在途（None 为不限），
+    返回 (单请求结果列表, 压测时长)"""
+    # aiohttp 只有 builtin 客户端用到，延迟 import 让 -g 启动更快
+    import aiohttp
+
+    url = base_url + "/v1/completions"
+    semaphore = asyncio.Semaphore(concurrency or max(len(payloads), 1))
+    timeout = aiohttp.ClientTimeout(total=6 * 60 * 60)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+
+        async def limited_request(payload):
+            async with semaphore:
+                return await builtin_request(session, url, headers, payload)
+
+        tasks = []
+        start = time.perf_counter()
+        for payload, arrival in zip(payloads, arrivals):
+            # 按绝对时刻而不是累加 sleep 发送，避免调度误差累积
+            delay = start + arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(limited_request(payload)))
+        outputs = await asyncio.gather(*tasks)
+        duration = time.perf_counter() - start
+    for output in outputs:
+        output["start"] -= start
+    return outputs, duration
+
+
+def steady_state_window(outputs, duration, steady_state):
+    """截取稳态测量窗口，去掉 case 开头 trim_head、结尾 trim_tail 比例时长的爬坡和收尾阶段。
+    窗口内发出的请求计入延迟统计，窗口内完成的请求计入吞吐统计，返回 (窗口内的请求列表, 窗口时长)"""
+    begin = duration * steady_state.get("trim_head", 0.1)
+    end = duration * (1 - steady_state.get("trim_tail", 0.1))
+    window = []
+    for output in outputs:
+        output["measure_latency"] = begin <= output["start"] < end
+        output["measure_throughput"] = begin <= output["start"] + output["e2e"] <= end
+        if output["measure_latency"] or output["measure_throughput"]:
+            window.append(output)
+    return window, end - begin
+
+
+def calc_bench_metrics(outputs, input_lens, duration, tokenizer=None):
+    """根据单请求结果计算与 sglang.bench_serving 输出同名的统计字段"""
+    ok = []
+    for output, input_len in zip(outputs, input_lens):
+        if not output["success"]:
+            continue
+        if "retokenized_len" in output:
+            # distributed worker 已经 retokenize 过，不再回传生成的文本
+            retokenized = output["retokenized_len"]
+        elif tokenizer is not None:
+            retokenized = len(
+                tokenizer.encode(output["generated_text"], add_special_tokens=False)
+            )
+        else:
+            retokenized = 0
+        ok.append((output, input_len, output["output_len"] or retokenized, retokenized))
+    # 稳态窗口模式下，延迟只统计窗口内发出的请求，吞吐只统计窗口内完成的请求
+    measured = [item for item in ok if item[0].get("measure_latency", True)]
+    done = [item for item in ok if item[0].get("measure_throughput", True)]
+    ttfts = np.array([output["ttft"] for output, *_ in measured]) * 1000
+    e2es = np.array([output["e2e"] for output, *_ in measured]) * 1000
+    itls = np.array([itl for output, *_ in measured for itl in output["itls"]]) * 1000
+    tpots = np.array(
+        [
+            (output["e2e"] - output["ttft"]) / (output_len - 1) * 1000
+            for output, _, output_len, _ in measured
+            if output_len > 1
+        ]
+    )
+    total_input = sum(input_len for _, input_len, _, _ in done)
+    total_output = sum(output_len for _, _, output_len, _ in done)
+
+    def stats(name, values, percentiles):
+        values = values if len(values) > 0 else np.zeros(1)
+        result = {
+            f"mean_{name}_ms": float(np.mean(values)),
+            f"median_{name}_ms": float(np.median(values)),
+            f"std_{name}_ms": float(np.std(values)),
+        }
+        for p in percentiles:
+            result[f"p{p}_{name}_ms"] = float(np.percentile(values, p))
+        return result
+
+    return {
+        "duration": duration,
+        "completed": len(done),
+        "total_input_tokens": total_input,
+        "total_output_tokens": total_output,
+        "total_output_tokens_retokenized": sum(retokenized for *_, retokenized in done),
+        "request_throughput": len(done) / duration,
+        "input_throughput": total_input / duration,
+        "output_throughput": total_output / duration,
+        **stats("e2e_latency", e2es, [99]),
+        **stats("ttft", ttfts, [99]),
+        **stats("tpot", tpots, [99]),
+        **stats("itl", itls, [95, 99]),
+        "concurrency": float(np.sum(e2es)) / 1000 / duration,
+    }
+
+
+def calc_goodput(ttfts, e2es, output_lens, duration, slo):
+    """满足单请求 SLO（ttft_ms、tpot_ms、e2e_ms 上限）的请求吞吐，延迟的单位为秒"""
+    ttfts = np.asarray(ttfts, dtype=float) * 1000
+    e2es = np.asarray(e2es, dtype=float) * 1000
+    tpots = (e2es - ttfts) / np.maximum(np.asarray(output_lens) - 1, 1)
+    good = np.ones(len(ttfts), dtype=bool)
+    for metric, values in [("ttft_ms", ttfts), ("tpot_ms", tpots), ("e2e_ms", e2es)]:
+        if metric in slo:
+            good &= values <= slo[metric]
+    return float(good.sum()) / duration
+
+
+# 自由度不超过该值时精确计算 t 分布分位数，更大的自由度用 Cornish-Fisher 展开近似
+T_EXACT_MAX_DF = 30
+
+
+def t_two_sided_cdf(t, df):
+    """整数自由度 df 的 t 分布 P(|T| <= t)，使用 Abramowitz & Stegun 26.7.3/26.7.4 的有限级数精确计算"""
+    theta = math.atan(t / math.sqrt(df))
+    cos2 = math.cos(theta) ** 2
+    if df % 2 == 1:
+        total, term = 0.0, 1.0
+        for j in range(1, (df - 1) // 2 + 1):
+            total += term
+            term *= cos2 * (2 * j) / (2 * j + 1)
+        return 2 / math.pi * (theta + math.sin(theta) * math.cos(theta) * total)
+    total, term = 0.0, 1.0
+    for j in range(1, df // 2 + 1):
+        total += term
+        term *= cos2 * (2 * j - 1) / (2 * j)
+    return math.sin(theta) * total
+
+
+def t_quantile(confidence, df):
+    """双侧 t 分布分位数，避免依赖 scipy。early_stop 和 --compare 常用的小自由度下 Cornish-Fisher 展开严重偏小
+    （df=1 时 95% 分位数为 7.15，实际是 12.71），df 不超过 T_EXACT_MAX_DF 时二分求解精确的 CDF；
+    非整数自由度（Welch t 检验）向下取整，结果偏保守"""
+    if df <= T_EXACT_MAX_DF:
+        df = max(math.floor(df), 1)
+        low, high = 0.0, 1.0
+        while t_two_sided_cdf(high, df) < confidence:
+            low, high = high, high * 2
+        for _ in range(100):
+            mid = (low + high) / 2
+            if t_two_sided_cdf(mid, df) < confidence:
+                low = mid
+            else:
+                high = mid
+        return high
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return z + (z**3 + z) / (4 * df) + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+
+
+def mean_ci_half_width(values, confidence):
+    """均值的 t 分布置信区间半宽"""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return float("inf")
+    return (
+        t_quantile(confidence, len(values) - 1)
+        * values.std(ddof=1)
+        / math.sqrt(len(values))
+    )
+
+
+def quantile_ci(values, q, confidence):
+    """分位数的非参数置信区间：对顺序统计量的秩使用二项分布的正态近似。
+    样本太少、秩超出样本范围时对应一侧的界未知，为 -inf 或 inf，不截断到最小或最大的样本"""
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 0:
+        return -float("inf"), float("inf")
+    half = NormalDist().inv_cdf((1 + confidence) / 2) * math.sqrt(n * q * (1 - q))
+    lo = math.floor(n * q - half)
+    hi = math.ceil(n * q + half)
+    values = np.partition(values, [min(max(lo, 0), n - 1), min(max(hi, 0), n - 1)])
+    return (
+        float(values[lo]) if lo >= 0 else -float("inf"),
+        float(values[hi]) if hi <= n - 1 else float("inf"),
+    )
+
+
+def calc_ci_metrics(outputs, throughput, batch_throughputs, confidence):
+    """计算吞吐以及 p99 ITL/TTFT 的置信区间，吞吐的区间半宽由各批次吞吐的波动估计。
+    无界的一侧（样本不足）记为 None，结果文件和 result_db 中是标准 JSON 的 null 而不是 Infinity"""
+    ok = [
+        output
+        for output in outputs
+        if output["success"] and output.get("measure_latency", True)
+    ]
+    ttfts = np.array([output["ttft"] for output in ok]) * 1000
+    itls = np.array([itl for output in ok for itl in output["itls"]]) * 1000
+    half = mean_ci_half_width(batch_throughputs, confidence)
+    result = {}
+    for name, (low, high) in [
+        ("request_throughput", (throughput - half, throughput + half)),
+        ("p99_itl_ms", quantile_ci(itls, 0.99, confidence)),
+        ("p99_ttft_ms", quantile_ci(ttfts, 0.99, confidence)),
+    ]:
+        result[f"{name}_ci_low"] = low if math.isfinite(low) else None
+        result[f"{name}_ci_high"] = high if math.isfinite(high) else None
+    return result
+
+
+def ci_converged(result, rel_ci_width):
+    """吞吐、p99 ITL、p99 TTFT 的置信区间相对宽度是否都不超过 rel_ci_width。
+    p99 的区间为 null 说明样本数还不足以给出上界，此时不把它作为提前结束的条件"""
+    for name in ["request_throughput", "p99_itl_ms", "p99_ttft_ms"]:
+        low, high = result[f"{name}_ci_low"], result[f"{name}_ci_high"]
+        if low is None or high is None:
+            if name == "request_throughput":
+                return False
+            continue
+        if high - low > rel_ci_width * result[name]:
+            return False
+    return True
+
+
+def benchmark_one_builtin(
+    workload,
+    client_config,
+    api_key,
+    endpoint,
+    concurrency,
+    repeat,
+    verbose=False,
+    early_stop=None,
+    steady_state=None,
+    save=True,
+    open_loop_case=None,
+):
+    """使用内置客户端压测一个 case，结果字段与 sglang.bench_serving 的输出文件一致。
+
+    配置 early_stop 时忽略 repeat，按批次发压，直到吞吐和（样本足够时）p99 ITL/TTFT 的置信区间足够窄。
+    配置 steady_state 时每批只统计稳态窗口内的请求。
+    传入 open_loop_case 时为开环压测，按其中的 qps 和到达过程发送 num_prompt 个请求，concurrency 为在途请求上限。
+    """
+    input_len = client_config.get("random_input_len", 1024)
+    output_len = client_config.get("random_output_len", 1024)
+    dataset = client_config.get("dataset_name", "random")
+    prefix_len = round(client_config.get("prefix_ratio", 0) * input_len)
+    seed = client_config.get("seed", 1)
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    arrival_config = open_loop_case or {}
+    request_rate = arrival_config.get("qps", concurrency)
+
+    def run_batch(num_prompt, batch_seed):
+        np.random.seed(batch_seed)
+        arrivals = arrival_times(
+            num_prompt,
+            request_rate,
+            arrival_config.get("arrival", "poisson"),
+            arrival_config.get("burstiness", 1.0),
+            arrival_config.get("trace"),
+        )
+        if workload.get("workers"):
+            case = {
+                "base_url": endpoint["base_url"],
+                "headers": headers,
+                "model": workload["model"],
+                "input_len": input_len,
+                "output_len": output_len,
+                "dataset": dataset,
+                "prefix_len": prefix_len,
+            }
+            outputs, duration = run_distributed_case(
+                workload["workers"],
+                case,
+                arrivals,
+                concurrency,
+                batch_seed,
+                workload["start_delay"],
+            )
+        else:
+            payloads, input_lens = build_builtin_payloads(
+                workload,
+                workload["model"],
+                num_prompt,
+                input_len,
+                output_len,
+                batch_seed,
+                dataset,
+                prefix_len,
+            )
+            outputs, duration = asyncio.run(
+                builtin_run_case(
+                    endpoint["base_url"], headers, payloads, concurrency, arrivals
+                )
+            )
+            for output, request_input_len in zip(outputs, input_lens):
+                output["input_len"] = request_input_len
+        if steady_state:
+            return steady_state_window(outputs, duration, steady_state)
+        return outputs, duration
+
+    ci_metrics = {}
+    if early_stop:
+        confidence = early_stop.get("confidence", 0.95)
+        batch_size = concurrency * early_stop.get("batch_repeat", 2)
+        min_requests = early_stop.get("min_requests", 0)
+        max_requests = early_stop.get("max_requests", 10000)
+        outputs, duration, batch_throughputs = [], 0.0, []
+        while True:
+            batch_outputs, batch_duration = run_batch(
+                batch_size, seed + len(batch_throughputs)
+            )
+            outputs += batch_outputs
+            duration += batch_duration
+            batch_throughputs.append(
+                sum(
+                    output["success"] and output.get("measure_throughput", True)
+                    for output in batch_outputs
+                )
+                / batch_duration
+            )
+            metrics = calc_bench_metrics(
+                outputs, [output["input_len"] for output in outputs], duration
+            )
+            ci_metrics = calc_ci_metrics(
+                outputs, metrics["request_throughput"], batch_throughputs, confidence
+            )
+            ci_metrics["early_stop_batches"] = len(batch_throughputs)
+            # 吞吐的置信区间由批次吞吐估计，与 --compare 一样至少需要 3 个样本
+            if len(outputs) >= max_requests or (
+                len(batch_throughputs) >= 3
+                and len(outputs) >= min_requests
+                and ci_converged(
+                    {**metrics, **ci_metrics}, early_stop.get("rel_ci_width", 0.05)
+                )
+            ):
+                break
+    elif open_loop_case:
+        outputs, duration = run_batch(open_loop_case["num_prompt"], seed)
+    else:
+        outputs, duration = run_batch(concurrency * repeat, seed)
+
+    errors = [output["error"] for output in outputs if not output["success"]]
+    if verbose and errors:
+        print(
+            f"{get_endpoint_name(endpoint)}: {len(errors)} requests failed, e.g. {errors[0]}"
+        )
+    result = {
+        "backend": "builtin",
+        "dataset_name": dataset,
+        "request_rate": request_rate,
+        "max_concurrency": concurrency,
+        "random_input_len": input_len,
+        "random_output_len": output_len,
+        "random_range_ratio": 1.0,
+        **calc_bench_metrics(
+            outputs,
+            [output["input_len"] for output in outputs],
+            duration,
+            workload["tokenizer"],
+        ),
+        **ci_metrics,
+    }
+    # 与延迟统计一致，原始样本和 goodput 只统计稳态窗口内发出的成功请求
+    measured = [
+        output
+        for output in outputs
+        if output["success"] and output.get("measure_latency", True)
+    ]
+    output_lens = [
+        output["output_len"] or output.get("retokenized_len") or len(output["itls"]) + 1
+        for output in measured
+    ]
+    if open_loop_case:
+        result["offered_qps"] = open_loop_case["qps"]
+        result["arrival"] = open_loop_case["arrival"]
+        if open_loop_case.get("goodput_slo"):
+            result["goodput"] = calc_goodput(
+                [output["ttft"] for output in measured],
+                [output["e2e"] for output in measured],
+                output_lens,
+                result["duration"],
+                open_loop_case["goodput_slo"],
+            )
+    if save:
+        save_samples(
+            endpoint,
+            result,
+            [output["ttft"] for output in measured],
+            [output["itls"] for output in measured],
+            [output["e2e"] for output in measured],
+            [output["input_len"] for output in measured],
+            output_lens,
+        )
+        save_result(endpoint, result)
+    return result
+
+
+def get_builtin_model(base_url, api_key):
+    """获取 endpoint 服务的模型名"""
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    res = requests.get(base_url + "/v1/models", headers=headers, timeout=30)
+    res.raise_for_status()
+    return res.json()["data"][0]["id"]
+
+
+def parse_address(address):
+    """ "host:port" -> (host, port)"""
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def worker_recv(conn):
+    """接收 worker 的回复，worker 出错时抛出异常"""
+    status, data = conn.recv()
+    if status != "ok":
+        raise RuntimeError(f"distributed worker failed: {data}")
+    return data
+
+
+def worker_loop(conn):
+    """distributed worker 处理一个 coordinator 连接：加载 workload，然后按指令准备请求、同步发压、回传单请求结果"""
+    workload = None
+    payloads = None
+    try:
+        while True:
+            command, args = conn.recv()
+            if command == "close":
+                break
+            try:
+                if command == "load":
+                    workload = load_builtin_workload(args)
+                    conn.send(("ok", None))
+                elif command == "case":
+                    # 先准备好请求体再回复，发压开始时间不受 tokenize 耗时影响
+                    case = args
+                    payloads, input_lens = build_builtin_payloads(
+                        workload,
+                        case["model"],
+                        len(case["arrivals"]),
+                        case["input_len"],
+                        case["output_len"],
+                        case["seed"],
+                        case.get("dataset", "random"),
+                        case.get("prefix_len", 0),
+                    )
+                    conn.send(("ok", None))
+                elif command == "start":
+                    time.sleep(max(args - time.time(), 0))
+                    outputs, duration = asyncio.run(
+                        builtin_run_case(
+                            case["base_url"],
+                            case["headers"],
+                            payloads,
+                            case["concurrency"],
+                            case["arrivals"],
+                        )
+                    )
+                    for output, request_input_len in zip(outputs, input_lens):
+                        output["input_len"] = request_input_len
+                        output["retokenized_len"] = len(
+                            workload["tokenizer"].encode(
+                                output.pop("generated_text", ""),
+                                add_special_tokens=False,
+                            )
+                        )
+                    conn.send(("ok", (outputs, duration)))
+                else:
+                    raise ValueError(f"unknown command {command}")
+            except Exception as e:
+                conn.send(("error", repr(e)))
+    except EOFError:
+        pass
+    finally:
+        conn.close()
+
+
+def serve_worker(address, authkey):
+    """distributed worker 服务，每个 coordinator 连接由一个子进程处理"""
+    with Listener(parse_address(address), authkey=authkey.encode()) as listener:
+        # 打印实际监听的地址，本机启动的 worker 监听随机端口，coordinator 从这里读取
+        print("%s:%d" % listener.address, flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError) as e:
+                print(f"Warning: failed to accept connection: {e!r}", file=sys.stderr)
+                continue
+            Process(target=worker_loop, args=(conn,), daemon=True).start()
+            conn.close()
+
+
+def connect_workers(distributed, client_config):
+    """连接 distributed worker 并加载 tokenizer 和数据集，workers 为整数时先在本机启动 worker 进程。
+    返回 (连接列表, 本机 worker 进程列表)"""
+    authkey = distributed.get("authkey", "bubble_bench")
+    addresses = distributed["workers"]
+    procs = []
+    if isinstance(addresses, int):
+        for _ in range(addresses):
+            procs.append(
+                subprocess.Popen(
+                    [
+                        sys.executable,
+                        os.path.abspath(__file__),
+                        "--worker",
+                        "127.0.0.1:0",
+                        "--authkey",
+                        authkey,
+                    ],
+                    stdout=subprocess.PIPE,
+                    text=True,
+                )
+            )
+        addresses = [proc.stdout.readline().strip() for proc in procs]
+    conns = [
+        Client(parse_address(address), authkey=authkey.encode())
+        for address in addresses
+    ]
+    for conn in conns:
+        conn.send(("load", client_config))
+    for conn in conns:
+        worker_recv(conn)
+    return conns, procs
+
+
+def close_workers(conns, procs):
+    for conn in conns:
+        try:
+            conn.send(("close", None))
+            conn.close()
+        except OSError:
+            pass
+    for proc in procs:
+        proc.terminate()
+        proc.wait()
+
+
+def run_distributed_case(conns, case, arrivals, concurrency, seed, start_delay):
+    """将一批请求的并发均分给各 worker，请求按到达顺序依并发比例分给各 worker，各 worker 同步开始发压，
+    合并返回 (单请求结果列表, 压测时长)。concurrency 为 None 时不限在途请求数，请求轮流分给各 worker"""
+    if concurrency:
+        bounds = [concurrency * i // len(conns) for i in range(len(conns) + 1)]
+        owners = (
+            np.searchsorted(bounds, np.arange(len(arrivals)) % concurrency, "right") - 1
+        )
+    else:
+        owners = np.arange(len(arrivals)) % len(conns)
+    active = []
+    for i, conn in enumerate(conns):
+        worker_arrivals = arrivals[owners == i]
+        if len(worker_arrivals) == 0:
+            continue
+        conn.send(
+            (
+                "case",
+                {
+                    **case,
+                    "concurrency": bounds[i + 1] - bounds[i] if concurrency else None,
+                    # 到达时间相对于所有 worker 共同的开始时刻，合起来就是整体的到达过程
+                    "arrivals": worker_arrivals,
+                    # 每个 worker 采样不同的 prompt
+                    "seed": seed * len(conns) + i,
+                },
+            )
+        )
+        active.append(conn)
+    for conn in active:
+        worker_recv(conn)
+    # 各 worker 在同一时刻开始发压，单请求的开始时间都相对于这一时刻
+    start_at = time.time() + start_delay
+    for conn in active:
+        conn.send(("start", start_at))
+    outputs, duration = [], 0.0
+    for conn in active:
+        worker_outputs, worker_duration = worker_recv(conn)
+        outputs += worker_outputs
+        duration = max(duration, worker_duration)
+    return outputs, duration
+
+
+def meets_slo(result, slo):
+    """压测结果是否满足 SLO，slo 的键是结果字段名，值是该字段的上限，如 {"p99_ttft_ms": 3000}"""
+    return all(result[metric] <= limit for metric, limit in slo.items())
+
+
+def adaptive_sweep(run_case, adaptive_config, throughput_scale=1.0):
+    """自适应并发扫描：从 min_concurrency 开始倍增并发（最后一步不超过 max_concurrency），直到违反 SLO 或吞吐增长低于 plateau_ratio，
+    然后在最后一个有效并发和拐点之间二分细化，返回 SLO 内的最大 QPS/GPU 等扫描结论"""
+    slo = adaptive_config.get("slo", {})
+    max_concurrency = adaptive_config.get("max_concurrency", 256)
+    plateau_ratio = adaptive_config.get("plateau_ratio", 0.03)
+    refine_steps = adaptive_config.get("refine_steps", 3)
+    results = {}
+
+    def measure(concurrency):
+        if concurrency not in results:
+            results[concurrency] = run_case(concurrency)
+        return results[concurrency]
+
+    def improves(concurrency, base):
+        # 满足 SLO 且吞吐相比 base 并发仍有明显增长
+        result = measure(concurrency)
+        return meets_slo(result, slo) and (
+            base is None
+            or result["request_throughput"]
+            > measure(base)["request_throughput"] * (1 + plateau_ratio)
+        )
+
+    # 倍增阶段：lo 为最后一个有效的并发，hi 为第一个饱和或违反 SLO 的并发
+    lo, hi = None, None
+    concurrency = adaptive_config.get("min_concurrency", 1)
+    while concurrency <= max_concurrency:
+        if not improves(concurrency, lo):
+            hi = concurrency
+            break
+        lo = concurrency
+        if concurrency == max_concurrency:
+            break
+        # 下一次倍增超过 max_concurrency 时最后压测 max_concurrency 本身，否则它可能从未被测到
+        concurrency = min(concurrency * 2, max_concurrency)
+    # 细化阶段：在 (lo, hi) 之间二分查找拐点
+    for _ in range(refine_steps):
+        if lo is None or hi is None or hi - lo <= 1:
+            break
+        mid = (lo + hi) // 2
+        if improves(mid, lo):
+            lo = mid
+        else:
+            hi = mid
+
+    compliant = [c for c, result in results.items() if meets_slo(result, slo)]
+    best = max(
+        compliant,
+        key=lambda c: results[c]["request_throughput"],
+        default=None,
+    )
+    return {
+        "slo": slo,
+        "knee_concurrency": lo,
+        "saturated_concurrency": hi,
+        "max_slo_concurrency": best,
+        "max_slo_qps_per_gpu": (
+            results[best]["request_throughput"] * throughput_scale
+            if best is not None
+            else None
+        ),
+        "tested_concurrencies": sorted(results),
+    }
+
+
+DEFAULT_SERVER_METRICS = [
+    "sglang:num_running_reqs",
+    "sglang:num_queue_reqs",
+    "sglang:token_usage",
+    "sglang:cache_hit_rate",
+    "sglang:gen_throughput",
+]
+
+SERVER_METRIC_LABELS = {
+    "sglang:num_running_reqs": "运行请求数",
+    "sglang:num_queue_reqs": "排队请求数",
+    "sglang:token_usage": "KV cache 占用率",
+    "sglang:cache_hit_rate": "Prefix cache 命中率",
+    "sglang:gen_throughput": "生成吞吐 (token/s)",
+}
+
+
+def parse_prometheus_metrics(text, names):
+    """从 Prometheus 文本格式中取出 names 中的指标，同名指标的多组 label 中计数类求和、其余取平均"""
+    values = defaultdict(list)
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = re.match(r"([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{.*\})?\s+(\S+)", line)
+        if not match or match.group(1) not in names:
+            continue
+        try:
+            values[match.group(1)].append(float(match.group(2)))
+        except ValueError:
+            continue
+    return {
+        name: (
+            sum(vals)
+            if name.split(":")[-1].startswith("num_")
+            else sum(vals) / len(vals)
+        )
+        for name, vals in values.items()
+    }
+
+
+class MetricsPoller:
+    """压测一个 case 期间在后台线程中按固定间隔轮询 endpoint 的 /metrics，记录指标的时间序列"""
+
+    def __init__(self, base_url, api_key, names, interval):
+        self.url = f"{base_url}/metrics"
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.names = list(names)
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        names = set(self.names)
+        start = time.perf_counter()
+        with requests.Session() as session:
+            while True:
+                t = time.perf_counter() - start
+                try:
+                    res = session.get(
+                        self.url, headers=self.headers, timeout=self.interval
+                    )
+                    if res.status_code == 200:
+                        self.samples.append(
+                            (t, parse_prometheus_metrics(res.text, names))
+                        )
+                except requests.RequestException:
+                    pass
+                # 按固定节拍采样，扣除请求 /metrics 本身的耗时
+                wait = self.interval - (time.perf_counter() - start - t)
+                if self.stop_event.wait(max(wait, 0)):
+                    break
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+    def series(self):
+        """{"timestamps": [相对 case 开始的秒数], "metrics": {指标名: [值，没采到为 None]}}"""
+        return {
+            "timestamps": [round(t, 3) for t, _ in self.samples],
+            "metrics": {
+                name: [values.get(name) for _, values in self.samples]
+                for name in self.names
+            },
+        }
+
+
+def with_server_metrics(run_case, endpoint, api_key, server_metrics):
+    """包装 run_case：每个 case（warmup 除外）压测期间轮询 /metrics，时间序列追加写入 {endpoint}.metrics.jsonl"""
+    endpoint_name = get_endpoint_name(endpoint)
+    names = server_metrics.get("metrics") or DEFAULT_SERVER_METRICS
+    interval = server_metrics.get("interval", 1.0)
+
+    def run_case_with_metrics(concurrency, repeat, warmup=False, open_loop_case=None):
+        if warmup:
+            return run_case(concurrency, repeat, warmup=True)
+        with MetricsPoller(endpoint["base_url"], api_key, names, interval) as poller:
+            result = run_case(concurrency, repeat, open_loop_case=open_loop_case)
+        record = {"_endpoint_name": endpoint_name, "max_concurrency": concurrency}
+        if open_loop_case:
+            record["offered_qps"] = open_loop_case["qps"]
+        record["interval"] = interval
+        record.update(poller.series())
+        with open(f"{endpoint_name}.metrics.jsonl", "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return result
+
+    return run_case_with_metrics
+
+
+RESULT_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    sweep_id TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sweep_id TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    server_version TEXT,
+    timestamp REAL NOT NULL,
+    max_concurrency REAL,
+    offered_qps REAL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_lookup
+    ON results (endpoint, config_hash, server_version, timestamp);
+CREATE INDEX IF NOT EXISTS results_latest
+    ON results (endpoint, config_hash, timestamp);
+CREATE INDEX IF NOT EXISTS results_sweep ON results (sweep_id);
+"""
+
+
+def open_result_db(db_path):
+    """打开结果数据库，多个压测进程同时追加写入时等待锁"""
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.executescript(RESULT_DB_SCHEMA)
+    return conn
+
+
+def sanitized_config(bench_config):
+    """去掉 api_key、authkey 等敏感信息的压测配置副本"""
+    config = json.loads(json.dumps(bench_config))
+    config.pop("api_key", None)
+    if "sglang_bench_cmd" in config:
+        config["sglang_bench_cmd"] = [
+            arg
+            for arg in config["sglang_bench_cmd"]
+            if not arg.startswith("OPENAI_API_KEY=")
+        ]
+    if config.get("distributed"):
+        config["distributed"].pop("authkey", None)
+    return config
+
+
+def config_hash(bench_config):
+    """压测负载相关配置的 hash：客户端、数据集和长度参数、提前结束、预热、稳态窗口和开环到达过程等影响测量结果的配置，
+    不含 endpoint 和并发/QPS 列表，同一 hash 下相同并发（或 QPS）的结果可以直接对比"""
+    config = sanitized_config(bench_config)
+    client = config.get("client", "sglang")
+    open_loop = dict(config.get("open_loop") or {})
+    open_loop.pop("qps", None)
+    workload = {
+        "client": client,
+        "workload": config.get(
+            "builtin_client" if client == "builtin" else "sglang_bench_cmd"
+        ),
+        "early_stop": config.get("early_stop"),
+        "warmup_requests": config.get("warmup_requests", 0),
+        "steady_state": config.get("steady_state"),
+        "open_loop": open_loop,
+    }
+    digest = hashlib.sha1(json.dumps(workload, sort_keys=True).encode())
+    return digest.hexdigest()[:12]
+
+
+def start_sweep(bench_config):
+    """在结果数据库中登记一次压测，返回 {"db", "sweep_id", "config_hash"}，result_db 为 null 时返回 None"""
+    db_path = bench_config.get("result_db", "bubble_bench.db")
+    if not db_path:
+        return None
+    sweep = {
+        "db": db_path,
+        "sweep_id": f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}",
+        "config_hash": config_hash(bench_config),
+    }
+    conn = open_result_db(db_path)
+    # WAL 模式下各 endpoint 的压测进程写入时不阻塞读
+    conn.execute("PRAGMA journal_mode=WAL")
+    with conn:
+        conn.execute(
+            "INSERT INTO sweeps VALUES (?, ?, ?, ?)",
+            (
+                sweep["sweep_id"],
+                time.time(),
+                sweep["config_hash"],
+                json.dumps(sanitized_config(bench_config)),
+            ),
+        )
+    conn.close()
+    return sweep
+
+
+def get_server_version(endpoint, api_key):
+    """从 /get_server_info 获取服务端版本，获取不到时为 None"""
+    with http_session() as session:
+        info = fetch_server_info(session, endpoint, api_key)
+    if not isinstance(info, dict) or info.get("version") is None:
+        return None
+    return str(info["version"])
+
+
+def with_result_db(run_case, endpoint, api_key, sweep):
+    """包装 run_case：每个 case（warmup 除外）完成后把结果追加写入结果数据库"""
+    endpoint_name = get_endpoint_name(endpoint)
+    server_version = get_server_version(endpoint, api_key)
+
+    def run_case_with_db(concurrency, repeat, warmup=False, open_loop_case=None):
+        result = run_case(
+            concurrency, repeat, warmup=warmup, open_loop_case=open_loop_case
+        )
+        if warmup or result is None:
+            return result
+        conn = open_result_db(sweep["db"])
+        with conn:
+            conn.execute(
+                "INSERT INTO results (sweep_id, endpoint, config_hash, server_version, "
+                "timestamp, max_concurrency, offered_qps, result) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    sweep["sweep_id"],
+                    endpoint_name,
+                    sweep["config_hash"],
+                    server_version,
+                    time.time(),
+                    result.get("max_concurrency"),
+                    result.get("offered_qps"),
+                    json.dumps(result),
+                ),
+            )
+        conn.close()
+        return result
+
+    return run_case_with_db
+
+
+# workload_matrix 的轴和组合名中的缩写
+WORKLOAD_AXES = {
+    "input_len": "in",
+    "output_len": "out",
+    "prefix_ratio": "prefix",
+    "dataset": "",
+}
+
+
+def workload_defaults(bench_config):
+    """未在 workload_matrix 中配置的轴的取值：builtin 客户端取 builtin_client，sglang 客户端从 sglang_bench_cmd 中解析"""
+    if bench_config.get("client", "sglang") == "builtin":
+        client_config = bench_config["builtin_client"]
+        return {
+            "input_len": client_config.get("random_input_len", 1024),
+            "output_len": client_config.get("random_output_len", 1024),
+            "prefix_ratio": client_config.get("prefix_ratio", 0),
+            "dataset": client_config.get("dataset_name", "random"),
+        }
+    cmd = " ".join(bench_config["sglang_bench_cmd"])
+
+    def arg(flag, default):
+        # 与 argparse 一致，重复的参数以最后一个为准
+        values = re.findall(rf"{flag}[ =](\S+)", cmd)
+        return values[-1] if values else default
+
+    return {
+        "input_len": int(arg("--random-input-len", 1024)),
+        "output_len": int(arg("--random-output-len", 1024)),
+        "prefix_ratio": 0,
+        "dataset": arg("--dataset-name", "sharegpt"),
+    }
+
+
+def workload_cell_name(cell, axes):
+    """负载组合中 axes 各轴取值组成的名字，例如 in256-out64-prefix0.5-random"""
+    return "-".join(
+        (
+            f"{WORKLOAD_AXES[axis]}{cell[axis]:g}"
+            if isinstance(cell[axis], (int, float))
+            else f"{WORKLOAD_AXES[axis]}{cell[axis]}"
+        )
+        for axis in axes
+        if cell[axis] is not None
+    )
+
+
+def expand_workload_matrix(bench_config):
+    """展开 workload_matrix 的笛卡尔积，返回组合列表，每个组合是 {"name", "axes": 矩阵中的轴, 各轴取值}。
+    没有配置 workload_matrix 时返回 [None]"""
+    matrix = bench_config.get("workload_matrix")
+    if not matrix:
+        return [None]
+    defaults = workload_defaults(bench_config)
+    axes = [axis for axis in WORKLOAD_AXES if axis in matrix]
+    cells = {}
+    for values in itertools.product(*(matrix[axis] for axis in axes)):
+        cell = {**defaults, **dict(zip(axes, values))}
+        if cell["dataset"] == "sharegpt":
+            # sharegpt 使用 prompt 的原始长度，只有 input_len 不同的组合是重复的
+            cell["input_len"] = None
+        name = workload_cell_name(cell, axes)
+        cells.setdefault(name, {"name": name, "axes": axes, **cell})
+    return list(cells.values())
+
+
+def workload_endpoints(bench_config, endpoint):
+    """endpoint 在负载矩阵每个组合下的压测目标，名为 {endpoint}@{组合名}，没有配置 workload_matrix 时为 endpoint 本身"""
+    cells = expand_workload_matrix(bench_config)
+    if cells == [None]:
+        return [endpoint]
+    endpoint_name = get_endpoint_name(endpoint)
+    return [
+        {
+            **endpoint,
+            "name": f"{endpoint_name}@{cell['name']}",
+            "_endpoint_base": endpoint_name,
+            "_cell": cell,
+        }
+        for cell in cells
+    ]
+
+
+def workload_config(bench_config, cell):
+    """把负载矩阵的一个组合应用到压测配置上，返回新的配置，不修改 bench_config"""
+    if cell is None:
+        return bench_config
+    config = dict(bench_config)
+    if bench_config.get("client", "sglang") == "builtin":
+        client_config = dict(bench_config["builtin_client"])
+        client_config["dataset_name"] = cell["dataset"]
+        if cell["input_len"] is not None:
+            client_config["random_input_len"] = cell["input_len"]
+        client_config["random_output_len"] = cell["output_len"]
+        client_config["prefix_ratio"] = cell["prefix_ratio"]
+        config["builtin_client"] = client_config
+        return config
+    # sglang.bench_serving 的重复参数以最后一个为准，追加到命令末尾即可覆盖
+    args = ["--dataset-name", cell["dataset"]]
+    if cell["dataset"] == "random":
+        args += [
+            "--random-input-len",
+            str(cell["input_len"]),
+            "--random-output-len",
+            str(cell["output_len"]),
+        ]
+    elif "output_len" in cell["axes"]:
+        args += ["--sharegpt-output-len", str(cell["output_len"])]
+    config["sglang_bench_cmd"] = bench_config["sglang_bench_cmd"] + [" ".join(args)]
+    return config
+
+
+def remove_result_files(endpoint_name):
+    """删除 endpoint 上一次压测的结果文件"""
+    for file in [
+        f"{endpoint_name}.bench",
+        f"{endpoint_name}.adaptive.json",
+        f"{endpoint_name}.metrics.jsonl",
+    ] + [
+        # 只删除 save_samples 写出的 {endpoint}-{并发}.npz 和 {endpoint}-qps{QPS}.npz，
+        # 前缀相同的其他 endpoint（例如 DeepSeek-R1 和 DeepSeek-R1-0528）的样本不能被删掉
+        file
+        for file in glob.glob(f"{glob.escape(endpoint_name)}-*.npz")
+        if re.fullmatch(re.escape(endpoint_name) + r"-(\d+|qps[\d.]+)\.npz", file)
+    ]:
+        if os.path.isfile(file):
+            os.remove(file)
+
+
+def benchmark_target(job_arg):
+    """压测一个 endpoint，配置了 workload_matrix 时依次压测每个组合，tokenizer、数据集和 worker 连接在组合间复用。
+    返回 [(压测目标名, 自适应扫描结论)]"""
+    job_id, bench_config, endpoint, repeats, verbose, sweep = job_arg
+    targets = workload_endpoints(bench_config, endpoint)
+    for target in targets:
+        remove_result_files(get_endpoint_name(target))
+
+    early_stop = bench_config.get("early_stop")
+    distributed = bench_config.get("distributed")
+    conns, procs = [], []
+    if bench_config.get("client", "sglang") == "builtin":
+        client_config = bench_config["builtin_client"]
+        api_key = bench_config.get("api_key")
+        if distributed:
+            # tokenizer 和数据集由各 worker 加载，本进程只负责分发和合并
+            conns, procs = connect_workers(distributed, client_config)
+            workload = {
+                "tokenizer": None,
+                "workers": conns,
+                "start_delay": distributed.get("start_delay", 0.5),
+            }
+        else:
+            # tokenizer 和数据集只加载一次，之后所有并发的压测都在本进程内完成
+            workload = load_builtin_workload(client_config)
+        workload["model"] = client_config.get("model") or get_builtin_model(
+            endpoint["base_url"], api_key
+        )
+
+    def case_runner(target_config, target):
+        if target_config.get("client", "sglang") == "builtin":
+
+            def run_case(concurrency, repeat, warmup=False, open_loop_case=None):
+                return benchmark_one_builtin(
+                    workload,
+                    target_config["builtin_client"],
+                    api_key,
+                    target,
+                    concurrency,
+                    repeat,
+                    verbose,
+                    None if warmup else early_stop,
+                    None if warmup else target_config.get("steady_state"),
+                    save=not warmup,
+                    open_loop_case=open_loop_case,
+                )
+
+        else:
+
+            def run_case(concurrency, repeat, warmup=False, open_loop_case=None):
+                return benchmark_one(
+                    target_config["sglang_bench_cmd"],
+                    target,
+                    concurrency,
+                    repeat,
+                    verbose,
+                    save=not warmup,
+                    raw_samples=target_config.get("raw_samples", False),
+                    open_loop_case=open_loop_case,
+                )
+
+        if target_config.get("server_metrics"):
+            run_case = with_server_metrics(
+                run_case,
+                target,
+                target_config.get("api_key"),
+                target_config["server_metrics"],
+            )
+        if sweep:
+            run_case = with_result_db(
+                run_case, target, target_config.get("api_key"), sweep
+            )
+        return run_case
+
+    summaries = []
+    try:
+        for target in targets:
+            target_config = workload_config(bench_config, target.get("_cell"))
+            run_case = case_runner(target_config, target)
+            summaries.append(
+                (
+                    get_endpoint_name(target),
+                    run_cases(job_id, target_config, target, repeats, run_case),
+                )
+            )
+    finally:
+        close_workers(conns, procs)
+    return summaries
+
+
+def run_cases(job_id, bench_config, endpoint, repeats, run_case):
+    """按配置预热并压测一个 endpoint 的所有并发或开环 QPS，自适应扫描时返回扫描结论"""
+    concurrencies = bench_config["concurs"]
+    endpoint_name = get_endpoint_name(endpoint)
+    adaptive_file = f"{endpoint_name}.adaptive.json"
+    early_stop = bench_config.get("early_stop")
+    if isinstance(repeats, list):
+        total_requests = sum(
+            concur * repeat for concur, repeat in zip(concurrencies, repeats)
+        )
+    else:
+        total_requests = sum(concurrencies) * repeats
+    if early_stop:
+        # 提前结束时每个并发的请求数事先未知，进度条只统计已完成的请求数
+        total_requests = None
+
+    adaptive_config = bench_config.get("adaptive")
+    warmup_requests = bench_config.get("warmup_requests", 0)
+    if warmup_requests > 0:
+        # 预热请求的结果直接丢弃，冷启动的 prefix cache 未命中等不会计入第一个 case
+        max_concurrency = (
+            adaptive_config.get("max_concurrency", 256)
+            if adaptive_config
+            else max(concurrencies)
+        )
+        concurrency = min(warmup_requests, max_concurrency)
+        run_case(concurrency, math.ceil(warmup_requests / concurrency), warmup=True)
+
+    open_loop = bench_config.get("open_loop")
+    if open_loop:
+        arrival = open_loop.get("arrival", "poisson")
+        trace = load_trace(open_loop["trace_path"]) if arrival == "trace" else None
+        cases = [
+            {
+                "qps": qps,
+                "num_prompt": max(round(qps * open_loop.get("duration", 60)), 1),
+                "arrival": arrival,
+                "burstiness": open_loop.get("burstiness", 1.0),
+                "trace": trace,
+                "goodput_slo": open_loop.get("goodput_slo"),
+            }
+            for qps in open_loop["qps"]
+        ]
+        process_bar = tqdm(
+            total=sum(case["num_prompt"] for case in cases),
+            desc=f"{endpoint_name}",
+            position=job_id,
+            unit=" req",
+        )
+        for case in cases:
+            process_bar.set_postfix(
+                {"case": f'"{arrival} arrival at {case["qps"]} qps"'}
+            )
+            run_case(open_loop.get("max_concurrency"), None, open_loop_case=case)
+            process_bar.update(case["num_prompt"])
+        return None
+
+    if adaptive_config:
+        # 自适应扫描事先不知道会压测哪些并发，进度条只统计已完成的请求数
+        process_bar = tqdm(desc=f"{endpoint_name}", position=job_id, unit=" req")
+        repeat = adaptive_config.get("repeat", 5)
+
+        def run_adaptive_case(concurrency):
+            process_bar.set_postfix(
+                {"case": f'"concur {concurrency} req repeat {repeat} times"'}
+            )
+            result = run_case(concurrency, repeat)
+            process_bar.update(
+                result["completed"] if early_stop else concurrency * repeat
+            )
+            return result
+
+        summary = adaptive_sweep(
+            run_adaptive_case, adaptive_config, endpoint.get("throughput_scale", 1.0)
+        )
+        with open(adaptive_file, "w") as f:
+            json.dump({"_endpoint_name": endpoint_name, **summary}, f, indent=2)
+        return summary
+
+    process_bar = tqdm(
+        total=total_requests, desc=f"{endpoint_name}", position=job_id, unit=" req"
+    )
+    for i, concurrency in enumerate(concurrencies):
+        repeat = repeats[i] if isinstance(repeats, list) else repeats
+        process_bar.set_postfix(
+            {"case": f'"concur {concurrency} req repeat {repeat} times"'}
+        )
+        result = run_case(concurrency, repeat)
+        process_bar.update(result["completed"] if early_stop else concurrency * repeat)
+
+
+def run_benchmark(bench_config, parallel_jobs, verbose=False):
+    if "repeats" in bench_config:
+        repeats = bench_config["repeats"]
+        if isinstance(repeats, list):
+            assert len(bench_config["repeats"]) == len(
+                bench_config["concurs"]
+            ), "'repeats' list and 'concurs' list should have the same size"
+    else:
+        repeats = 10
+    assert (
+        not bench_config.get("early_stop")
+        or bench_config.get("client", "sglang") == "builtin"
+    ), "'early_stop' needs per-request samples, only supported by the builtin client"
+    assert (
+        not bench_config.get("steady_state")
+        or bench_config.get("client", "sglang") == "builtin"
+    ), "'steady_state' needs per-request timestamps, only supported by the builtin client"
+    assert (
+        not bench_config.get("distributed")
+        or bench_config.get("client", "sglang") == "builtin"
+    ), "'distributed' load generation is only supported by the builtin client"
+    open_loop = bench_config.get("open_loop")
+    if open_loop:
+        assert not bench_config.get("adaptive") and not bench_config.get(
+            "early_stop"
+        ), "'open_loop' sweeps QPS, can not be used with 'adaptive' or 'early_stop'"
+        assert (
+            open_loop.get("arrival", "poisson") != "trace"
+            or bench_config.get("client", "sglang") == "builtin"
+        ), "'trace' arrival is only supported by the builtin client"
+    base_urls = set()
+    names = set()
+    for ep in bench_config["endpoints"]:
+        assert ep["base_url"] not in base_urls, f"Duplicate endpoint.base_url {ep}"
+        base_urls.add(ep["base_url"])
+        if "name" in ep and ep["name"] is not None:
+            assert ep["name"] not in names, f"Duplicate endpoint.name {ep}"
+            names.add(ep["name"])
+    for cell in expand_workload_matrix(bench_config):
+        cell = cell or workload_defaults(bench_config)
+        assert cell["dataset"] in (
+            "random",
+            "sharegpt",
+        ), f"Unsupported dataset {cell['dataset']}, should be 'random' or 'sharegpt'"
+        assert 0 <= cell["prefix_ratio"] < 1, "'prefix_ratio' should be in [0, 1)"
+        assert (
+            cell["prefix_ratio"] == 0
+            or bench_config.get("client", "sglang") == "builtin"
+        ), "'prefix_ratio' is only supported by the builtin client"
+        assert (
+            cell["dataset"] != "sharegpt"
+            or bench_config.get("client", "sglang") != "builtin"
+            or bench_config["builtin_client"].get("dataset_path")
+        ), "'sharegpt' dataset of the builtin client needs 'dataset_path'"
+    if "api_key" in bench_config and bench_config["api_key"] is not None:
+        bench_config["sglang_bench_cmd"].insert(0, f"OPENAI_API_KEY={bench_config['api_key']}")
+
+    print(
+        "BubbleBenchmarking for endpoints: "
+        + ", ".join([get_endpoint_name(v) for v in bench_config["endpoints"]])
+    )
+    # 压测开始前记录服务器信息和执行环境，压测结束后服务不可用时报告也能使用缓存
+    get_server_info(bench_config)
+    get_env_info(refresh=True)
+    sweep = start_sweep(bench_config)
+    jobs = [
+        (
+            job_id,
+            bench_config,
+            endpoint,
+            repeats,
+            verbose,
+            sweep,
+        )
+        for job_id, endpoint in enumerate(bench_config["endpoints"])
+    ]
+    with Pool(processes=parallel_jobs) as pool:
+        summaries = pool.map(benchmark_target, jobs)
+    for endpoint_name, summary in [
+        target_summary
+        for job_summaries in summaries
+        for target_summary in job_summaries
+    ]:
+        if summary is not None:
+            print(
+                f"{endpoint_name}: max SLO-compliant QPS/GPU "
+                f"{summary['max_slo_qps_per_gpu']} at concurrency {summary['max_slo_concurrency']}, "
+                f"throughput knee at concurrency {summary['knee_concurrency']}"
+            )
+
+
+# --compare 对比的指标：(结果字段, 名称, 是否越大越好, 显著性检验方式)。
+# "mean" 用均值、标准差和请求数做 Welch t 检验，只用于每个请求一个样本的指标；其余的只有一个值，用基线多次压测的预测区间，
+# 或者 early_stop 的置信区间判断。ITL 每个 token 一个样本，同一请求内的样本相关，TPOT 的样本数（输出多于 1 个 token 的请求数）
+# 不在结果中，二者的请求数都不是样本数，按单值对比
+COMPARE_METRICS = [
+    ("request_throughput", "request throughput", True, "value"),
+    ("output_throughput", "output throughput", True, "value"),
+    ("ttft_ms", "mean TTFT", False, "mean"),
+    ("mean_tpot_ms", "mean TPOT", False, "value"),
+    ("mean_itl_ms", "mean ITL", False, "value"),
+    ("e2e_latency_ms", "mean E2E latency", False, "mean"),
+    ("p99_ttft_ms", "P99 TTFT", False, "value"),
+    ("p99_itl_ms", "P99 ITL", False, "value"),
+]
+
+
+def pooled_stats(results, name):
+    """合并多个结果的 (请求数, 均值, 标准差)，没有完成的请求时均值和标准差为 None"""
+    n = sum(result["completed"] for result in results)
+    if n == 0:
+        return 0, None, None
+    mean = sum(result["completed"] * result[f"mean_{name}"] for result in results) / n
+    var = (
+        sum(
+            result["completed"]
+            * (result[f"std_{name}"] ** 2 + (result[f"mean_{name}"] - mean) ** 2)
+            for result in results
+        )
+        / n
+    )
+    return n, mean, math.sqrt(var)
+
+
+def compare_metric(baseline, current, name, kind, alpha):
+    """返回 (基线值, 当前值, 差异是否显著)，差异无法检验时显著性为 None"""
+    if kind == "mean":
+        n1, mean1, std1 = pooled_stats(baseline, name)
+        n2, mean2, std2 = pooled_stats(current, name)
+        if n1 < 2 or n2 < 2:
+            return mean1, mean2, None
+        var1, var2 = std1**2 / n1, std2**2 / n2
+        if var1 + var2 == 0:
+            # 没有波动时无法估计噪声，不能把任何差异都当作显著
+            return mean1, mean2, None
+        t = (mean2 - mean1) / math.sqrt(var1 + var2)
+        # Welch–Satterthwaite 自由度
+        df = (var1 + var2) ** 2 / (
+            (var1**2 / (n1 - 1) if n1 > 1 else 0)
+            + (var2**2 / (n2 - 1) if n2 > 1 else 0)
+            or 1
+        )
+        return mean1, mean2, abs(t) > t_quantile(1 - alpha, max(df, 1))
+    values = [result[name] for result in baseline]
+    value1 = sum(values) / len(values)
+    value2 = sum(result[name] for result in current) / len(current)
+    if len(values) >= 3:
+        # 当前结果落在基线多次压测的预测区间之外，自由度太小时 t 分位数的近似误差太大，至少需要 3 次
+        half = (
+            t_quantile(1 - alpha, len(values) - 1)
+            * np.std(values, ddof=1)
+            * math.sqrt(1 + 1 / len(values))
+        )
+        return value1, value2, abs(value2 - value1) > half
+    low, high = f"{name}_ci_low", f"{name}_ci_high"
+    if all(
+        result.get(low) is not None and result.get(high) is not None
+        for result in baseline + current
+    ):
+        # early_stop 模式下两次压测的置信区间不重叠
+        return (
+            value1,
+            value2,
+            current[0][low] > baseline[0][high] or current[0][high] < baseline[0][low],
+        )
+    return value1, value2, None
+
+
+def compare_results(db_path, baseline, bench_config=None):
+    """将每个 (endpoint, 配置 hash) 最近一次压测与基线对比，打印显著的变化，有回退时返回 1；
+    数据库不存在、为空或者找不到任何可对比的基线结果时返回 2，与回退区分开。
+    baseline 为 "previous"（同一 endpoint 和配置的上一次压测）、sweep id 或者服务端版本"""
+    regression = {"alpha": 0.05, "min_change": 0.05}
+    regression.update((bench_config or {}).get("regression") or {})
+    if not os.path.isfile(db_path):
+        print(f"Result database {db_path} not found, nothing to compare")
+        return 2
+    conn = open_result_db(db_path)
+    if bench_config:
+        chash = config_hash(bench_config)
+        groups = [
+            (get_endpoint_name(target), chash)
+            for endpoint in bench_config["endpoints"]
+            for target in workload_endpoints(bench_config, endpoint)
+        ]
+    else:
+        groups = conn.execute(
+            "SELECT DISTINCT endpoint, config_hash FROM results"
+        ).fetchall()
+    is_sweep = (
+        conn.execute("SELECT 1 FROM sweeps WHERE sweep_id = ?", (baseline,)).fetchone()
+        is not None
+    )
+
+    def query_cases(where, params):
+        cases = defaultdict(list)
+        for max_concurrency, offered_qps, result in conn.execute(
+            f"SELECT max_concurrency, offered_qps, result FROM results WHERE {where}",
+            params,
+        ):
+            cases[(max_concurrency, offered_qps)].append(json.loads(result))
+        return cases
+
+    regressions = 0
+    # 与基线有相同并发（或 QPS）的 case 数
+    compared = 0
+    for endpoint_name, chash in groups:
+        latest = conn.execute(
+            "SELECT sweep_id, timestamp FROM results WHERE endpoint = ? AND config_hash = ? "
+            "ORDER BY timestamp DESC LIMIT 1",
+            (endpoint_name, chash),
+        ).fetchone()
+        if latest is None:
+            continue
+        current_sweep = latest[0]
+        key = "endpoint = ? AND config_hash = ?"
+        if baseline == "previous":
+            previous = conn.execute(
+                f"SELECT sweep_id FROM results WHERE {key} AND sweep_id != ? "
+                "ORDER BY timestamp DESC LIMIT 1",
+                (endpoint_name, chash, current_sweep),
+            ).fetchone()
+            if previous is None:
+                print(f"{endpoint_name} [{chash}]: no previous sweep to compare")
+                continue
+            baseline_cases = query_cases(
+                f"{key} AND sweep_id = ?", (endpoint_name, chash, previous[0])
+            )
+            baseline_desc = f"sweep {previous[0]}"
+        elif is_sweep:
+            baseline_cases = query_cases(
+                f"{key} AND sweep_id = ?", (endpoint_name, chash, baseline)
+            )
+            baseline_desc = f"sweep {baseline}"
+        else:
+            baseline_cases = query_cases(
+                f"{key} AND server_version = ? AND sweep_id != ?",
+                (endpoint_name, chash, baseline, current_sweep),
+            )
+            baseline_desc = f"server version {baseline}"
+        if not baseline_cases:
+            print(f"{endpoint_name} [{chash}]: no results of {baseline_desc}")
+            continue
+        current_cases = query_cases(
+            f"{key} AND sweep_id = ?", (endpoint_name, chash, current_sweep)
+        )
+        print(f"{endpoint_name} [{chash}]: sweep {current_sweep} vs {baseline_desc}")
+        for case in sorted(
+            current_cases, key=lambda case: (case[1] or 0, case[0] or 0)
+        ):
+            if case not in baseline_cases:
+                continue
+            compared += 1
+            max_concurrency, offered_qps = case
+            case_name = (
+                f"qps {offered_qps:g}"
+                if offered_qps is not None
+                else f"concurrency {max_concurrency:g}"
+            )
+            for name, label, higher_better, kind in COMPARE_METRICS:
+                field = f"mean_{name}" if kind == "mean" else name
+                results = baseline_cases[case] + current_cases[case]
+                if not all(field in result for result in results) or (
+                    kind == "mean"
+                    and not all(f"std_{name}" in result for result in results)
+                ):
+                    continue
+                value1, value2, significant = compare_metric(
+                    baseline_cases[case],
+                    current_cases[case],
+                    name,
+                    kind,
+                    regression["alpha"],
+                )
+                if value1 is None or value2 is None:
+                    continue
+                change = (value2 - value1) / value1 if value1 else 0.0
+                worse = -change if higher_better else change
+                if abs(change) < regression["min_change"] or significant is False:
+                    continue
+                if significant is None:
+                    verdict = "changed (not enough samples to test)"
+                elif worse > 0:
+                    verdict = "REGRESSION"
+                    regressions += 1
+                else:
+                    verdict = "improved"
+                print(
+                    f"  {case_name}: {label} {value1:.2f} -> {value2:.2f} "
+                    f"({change:+.1%}) {verdict}"
+                )
+    conn.close()
+    if not regressions and not compared:
+        print("No baseline results to compare")
+        return 2
+    print(f"{regressions} significant regression(s) found")
+    return 1 if regressions else 0
+
+
+def compare_config_results(bench_config, baseline):
+    """对比压测配置的 result_db 中的结果，result_db 为 null 时没有历史结果可比，返回 2"""
+    db_path = bench_config.get("result_db", "bubble_bench.db")
+    if not db_path:
+        print("'result_db' is null, nothing to compare")
+        return 2
+    return compare_results(db_path, baseline, bench_config)
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets 降采样：按 x 有序的 (n, 2) 点列保留 threshold 个点，首尾点总是保留，
+    每个桶中选与前一个选中点、下一个桶平均点构成的三角形面积最大的点"""
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    sampled = np.empty((threshold, 2))
+    sampled[0] = points[0]
+    sampled[-1] = points[-1]
+    # 去掉首尾后的 n - 2 个点均分成 threshold - 2 个桶
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = points[0]
+    for i in range(threshold - 2):
+        bucket = points[edges[i] : edges[i + 1]]
+        if i + 2 < len(edges):
+            following = points[edges[i + 1] : edges[i + 2]].mean(axis=0)
+        else:
+            following = points[-1]
+        area = np.abs(
+            (selected[0] - following[0]) * (bucket[:, 1] - selected[1])
+            - (selected[0] - bucket[:, 0]) * (following[1] - selected[1])
+        )
+        selected = bucket[area.argmax()]
+        sampled[i + 1] = selected
+    return sampled
+
+
+# 点数不少于这个值的折线才编码成二进制，小的 series 保持 JSON 便于阅读
+COMPACT_MIN_POINTS = 64
+
+
+def compact_charts(charts, max_points):
+    """大的折线 series 用 LTTB 降采样到 max_points 个点，再以 base64 编码的小端 Float32Array 存储，由页面解码"""
+    for chart in charts:
+        for serie in chart.get("series", []):
+            data = serie.get("data")
+            if (
+                serie.get("type") != "line"
+                or not isinstance(data, list)
+                or len(data) < COMPACT_MIN_POINTS
+            ):
+                continue
+            try:
+                points = np.asarray(data, dtype=np.float64)
+            except (TypeError, ValueError):
+                continue
+            if (
+                points.ndim != 2
+                or points.shape[1] != 2
+                or not np.isfinite(points).all()
+            ):
+                continue
+            points = lttb(points, max_points)
+            serie["data"] = {
+                "f32": base64.b64encode(points.astype("<f4").tobytes()).decode()
+            }
+    return charts
+
+
+def line_chart_option(title, x_name, y_name, series):
+    """折线图的 ECharts 配置，series 较多时图例可以滚动"""
+    return {
+        "title": {"text": title, "left": "center"},
+        "legend": {
+            "top": 30,
+            "type": "scroll",
+            "data": [serie["name"] for serie in series],
+        },
+        "grid": {"top": 60, "left": 140},
+        "tooltip": {"trigger": "axis"},
+        "xAxis": {"name": x_name, "type": "value"},
+        "yAxis": {"name": y_name, "type": "value"},
+        "series": series,
+    }
+
+
+def open_loop_charts(df):
+    """开环压测结果按请求到达率绘图：吞吐和 goodput 随负载的变化，以及延迟随负载的变化"""
+    df = df.sort_values("offered_qps")
+    groups = list(df.groupby(["_endpoint_name", "arrival"], sort=False))
+    offered = sorted(df["offered_qps"].unique().tolist())
+    charts = []
+    for title, y_name, metrics in [
+        (
+            "吞吐与 Goodput vs 请求到达率",
+            "QPS (未平均到 GPU)",
+            [("request_throughput", "吞吐"), ("goodput", "Goodput")],
+        ),
+        ("P99 TTFT vs 请求到达率", "P99 TTFT (ms)", [("p99_ttft_ms", "")]),
+        ("平均 ITL vs 请求到达率", "平均 ITL (ms)", [("mean_itl_ms", "")]),
+        ("P99 ITL vs 请求到达率", "P99 ITL (ms)", [("p99_itl_ms", "")]),
+        (
+            "P99 E2E 延迟 vs 请求到达率",
+            "P99 E2E 延迟 (ms)",
+            [("p99_e2e_latency_ms", "")],
+        ),
+    ]:
+        series = []
+        if metrics[0][0] == "request_throughput":
+            # 参考线：吞吐等于请求到达率，即服务端没有积压
+            series.append(
+                {
+                    "name": "请求到达率",
+                    "type": "line",
+                    "lineStyle": {"type": "dashed"},
+                    "data": [[qps, qps] for qps in offered],
+                }
+            )
+        for (endpoint, arrival), group in groups:
+            for metric, label in metrics:
+                if metric not in group.columns or group[metric].isna().all():
+                    continue
+                series.append(
+                    {
+                        "name": f"{endpoint} {arrival} {label}".rstrip(),
+                        "type": "line",
+                        "data": group[["offered_qps", metric]]
+                        .dropna()
+                        .round(2)
+                        .values.tolist(),
+                    }
+                )
+        charts.append(line_chart_option(title, "请求到达率 (QPS)", y_name, series))
+    return charts
+
+
+def load_samples(df, cache=None):
+    """读取结果中 _samples_file 指向的 .npz，同一 endpoint、同一并发的多次压测样本合并在一起。
+    cache 为 {文件名: (mtime, 样本)}，实时报告用它避免重复读取没有变化的文件。
+    返回 {(endpoint_name, 并发): {"ttft_ms": ..., "itl_ms": ..., "e2e_ms": ...}}"""
+    samples = {}
+    if "_samples_file" not in df.columns:
+        return samples
+    for (endpoint, concurrency), files in df.groupby(
+        ["_endpoint_name", "max_concurrency"], sort=False
+    )["_samples_file"]:
+        arrays = defaultdict(list)
+        for file in files.dropna():
+            if not os.path.isfile(file):
+                continue
+            mtime = os.path.getmtime(file)
+            if cache is not None and file in cache and cache[file][0] == mtime:
+                file_samples = cache[file][1]
+            else:
+                with np.load(file) as npz:
+                    file_samples = {
+                        key: npz[key] for key in ["ttft_ms", "itl_ms", "e2e_ms"]
+                    }
+                if cache is not None:
+                    cache[file] = (mtime, file_samples)
+            for key, values in file_samples.items():
+                arrays[key].append(values)
+        if arrays:
+            samples[(endpoint, int(concurrency))] = {
+                key: np.concatenate(values) for key, values in arrays.items()
+            }
+    return samples
+
+
+def sample_charts(samples, percentiles, max_points=1000):
+    """根据原始样本生成 TTFT/ITL 分位数随并发变化的折线图、CDF 曲线和 ITL 直方图"""
+    charts = []
+    endpoints = list(dict.fromkeys(endpoint for endpoint, _ in samples))
+
+    cases = sorted(
+        samples.items(), key=lambda item: (endpoints.index(item[0][0]), item[0][1])
+    )
+    for key, name in [("ttft_ms", "TTFT"), ("itl_ms", "ITL")]:
+        # 每个 case 一次 np.percentile 算出所有分位数
+        series = defaultdict(list)
+        for (endpoint, concurrency), values in cases:
+            if len(values[key]) == 0:
+                continue
+            for p, value in zip(percentiles, np.percentile(values[key], percentiles)):
+                series[(endpoint, p)].append([concurrency, round(float(value), 2)])
+        charts.append(
+            line_chart_option(
+                f"{name} 分位数（原始样本）",
+                "并发",
+                f"{name} (ms)",
+                [
+                    {
+                        "name": f"{endpoint} P{p}",
+                        "type": "line",
+                        "data": series[(endpoint, p)],
+                    }
+                    for endpoint in endpoints
+                    for p in percentiles
+                    if (endpoint, p) in series
+                ],
+            )
+        )
+
+    for key, name in [("ttft_ms", "TTFT"), ("itl_ms", "ITL")]:
+        series = []
+        for (endpoint, concurrency), values in cases:
+            if len(values[key]) == 0:
+                continue
+            # 完整的经验 CDF 用 LTTB 降采样，比等间隔取分位数更能保留长尾的形状
+            xs = np.sort(values[key])
+            ys = np.arange(1, len(xs) + 1) / len(xs) * 100
+            series.append(
+                {
+                    "name": f"{endpoint} 并发 {concurrency}",
+                    "type": "line",
+                    "showSymbol": False,
+                    "data": lttb(np.column_stack([xs, ys]), max_points)
+                    .round(2)
+                    .tolist(),
+                }
+            )
+        charts.append(
+            line_chart_option(
+                f"{name} CDF（原始样本）", f"{name} (ms)", "累计比例 (%)", series
+            )
+        )
+
+    # ITL 直方图：所有 case 共用分箱，超过 P99.9 的长尾归入最后一个分箱
+    itls = [values["itl_ms"] for _, values in cases if len(values["itl_ms"]) > 0]
+    if itls:
+        upper = max(float(np.percentile(itl, 99.9)) for itl in itls)
+        bins = np.linspace(0, max(upper, 1e-3), 101)
+        centers = ((bins[:-1] + bins[1:]) / 2).round(2)
+        series = []
+        for (endpoint, concurrency), values in cases:
+            if len(values["itl_ms"]) == 0:
+                continue
+            counts, _ = np.histogram(np.minimum(values["itl_ms"], bins[-1]), bins)
+            series.append(
+                {
+                    "name": f"{endpoint} 并发 {concurrency}",
+                    "type": "line",
+                    "step": "middle",
+                    "showSymbol": False,
+                    "data": np.column_stack(
+                        [centers, (counts / counts.sum() * 100).round(3)]
+                    ).tolist(),
+                }
+            )
+        charts.append(
+            line_chart_option(
+                "ITL 直方图（原始样本）", "ITL (ms)", "Token 占比 (%)", series
+            )
+        )
+    return charts
+
+
+def server_metrics_charts(df, metrics_rows, x_key, x_name):
+    """服务端指标图：每个 case 指标的平均值和最大值随负载的变化，右轴叠加 P99 TTFT 对照延迟拐点；以及每个 case 内指标的时间序列"""
+    if df.empty or not metrics_rows:
+        return []
+    ttft = {
+        (endpoint, float(x)): value
+        for (endpoint, x), value in df.groupby(["_endpoint_name", x_key])["p99_ttft_ms"]
+        .mean()
+        .items()
+    }
+    endpoints = list(dict.fromkeys(row["_endpoint_name"] for row in metrics_rows))
+    records = sorted(
+        metrics_rows,
+        key=lambda row: (endpoints.index(row["_endpoint_name"]), row[x_key]),
+    )
+    names = list(dict.fromkeys(name for row in records for name in row["metrics"]))
+    case_label = "并发" if x_key == "max_concurrency" else "QPS"
+    charts = []
+    for name in names:
+        label = SERVER_METRIC_LABELS.get(name, name)
+        series = []
+        for endpoint in endpoints:
+            means, maxes, ttfts = [], [], []
+            for row in records:
+                values = [
+                    value for value in row["metrics"].get(name, []) if value is not None
+                ]
+                if row["_endpoint_name"] != endpoint or not values:
+                    continue
+                x = row[x_key]
+                means.append([x, round(sum(values) / len(values), 4)])
+                maxes.append([x, round(max(values), 4)])
+                if (endpoint, float(x)) in ttft:
+                    ttfts.append([x, round(ttft[(endpoint, float(x))], 2)])
+            if not means:
+                continue
+            series += [
+                {"name": f"{endpoint} 平均", "type": "line", "data": means},
+                {
+                    "name": f"{endpoint} 最大",
+                    "type": "line",
+                    "lineStyle": {"type": "dashed"},
+                    "data": maxes,
+                },
+                {
+                    "name": f"{endpoint} P99 TTFT",
+                    "type": "line",
+                    "yAxisIndex": 1,
+                    "lineStyle": {"type": "dotted"},
+                    "data": ttfts,
+                },
+            ]
+        if not series:
+            continue
+        option = line_chart_option(
+            f"服务端{label}与 P99 TTFT vs {x_name}", x_name, label, series
+        )
+        option["yAxis"] = [
+            option["yAxis"],
+            {"name": "P99 TTFT (ms)", "type": "value", "position": "right"},
+        ]
+        charts.append(option)
+
+        # case 内的时间序列，用于查看排队和 KV cache 占用是否在压测过程中持续上涨
+        series = []
+        for row in records:
+            data = [
+                [t, round(value, 4)]
+                for t, value in zip(row["timestamps"], row["metrics"].get(name, []))
+                if value is not None
+            ]
+            if data:
+                series.append(
+                    {
+                        "name": f"{row['_endpoint_name']} {case_label} {row[x_key]}",
+                        "type": "line",
+                        "showSymbol": False,
+                        "data": data,
+                    }
+                )
+        charts.append(
+            line_chart_option(f"服务端{label}时间序列", "压测时间 (s)", label, series)
+        )
+    return charts
+
+
+# 闭环压测结果数据集的列，所有 endpoint 的数据集列相同，图表按列名 encode，气泡图的 tooltip 按列下标取值
+DATASET_DIMENSIONS = [
+    "max_concurrency",
+    "mean_itl_ms",
+    "median_itl_ms",
+    "p95_itl_ms",
+    "p99_itl_ms",
+    "std_itl_ms",
+    "p99_itl_ms_ci_low",
+    "p99_itl_ms_ci_high",
+    "mean_ttft_s",
+    "median_ttft_s",
+    "p99_ttft_s",
+    "std_ttft_s",
+    "p99_ttft_s_ci_low",
+    "p99_ttft_s_ci_high",
+    "mean_e2e_latency_s",
+    "median_e2e_latency_s",
+    "p99_e2e_latency_s",
+    "qps_per_gpu",
+    "qps_per_gpu_ci_low",
+    "qps_per_gpu_ci_high",
+    "request_throughput",
+    "input_throughput",
+    "output_throughput",
+    "concurrency",
+    "total_io_throughput",
+    "total_input_tokens",
+    "total_output_tokens",
+    "completed",
+    "mean_input_tokens",
+    "mean_output_tokens",
+]
+
+
+def endpoint_datasets(df, endpoints):
+    """把闭环压测结果整列换算成 DATASET_DIMENSIONS，再一次 groupby 拆成每个 endpoint 一个 ECharts dataset"""
+    import pandas as pd
+
+    def column(name):
+        # 置信区间等可选字段不存在时为空，无界的置信区间为 null，全为 null 的列是 object 类型，转成数值
+        if name not in df.columns:
+            return pd.Series(np.nan, index=df.index)
+        return pd.to_numeric(df[name], errors="coerce")
+
+    scale = df["_throughput_scale"]
+    data = pd.DataFrame(
+        {
+            "max_concurrency": df["max_concurrency"],
+            "mean_itl_ms": df["mean_itl_ms"],
+            "median_itl_ms": df["median_itl_ms"],
+            "p95_itl_ms": df["p95_itl_ms"],
+            "p99_itl_ms": df["p99_itl_ms"],
+            "std_itl_ms": df["std_itl_ms"],
+            "p99_itl_ms_ci_low": column("p99_itl_ms_ci_low"),
+            "p99_itl_ms_ci_high": column("p99_itl_ms_ci_high"),
+            "mean_ttft_s": df["mean_ttft_ms"] / 1000,
+            "median_ttft_s": df["median_ttft_ms"] / 1000,
+            "p99_ttft_s": df["p99_ttft_ms"] / 1000,
+            "std_ttft_s": df["std_ttft_ms"] / 1000,
+            "p99_ttft_s_ci_low": column("p99_ttft_ms_ci_low") / 1000,
+            "p99_ttft_s_ci_high": column("p99_ttft_ms_ci_high") / 1000,
+            "mean_e2e_latency_s": df["mean_e2e_latency_ms"] / 1000,
+            "median_e2e_latency_s": df["median_e2e_latency_ms"] / 1000,
+            "p99_e2e_latency_s": df["p99_e2e_latency_ms"] / 1000,
+            "qps_per_gpu": df["request_throughput"] * scale,
+            "qps_per_gpu_ci_low": column("request_throughput_ci_low") * scale,
+            "qps_per_gpu_ci_high": column("request_throughput_ci_high") * scale,
+            "request_throughput": df["request_throughput"],
+            "input_throughput": df["input_throughput"],
+            "output_throughput": df["output_throughput"],
+            "concurrency": df["concurrency"],
+            "total_io_throughput": df["input_throughput"] + df["output_throughput"],
+            "total_input_tokens": df["total_input_tokens"],
+            "total_output_tokens": df["total_output_tokens"],
+            "completed": column("completed"),
+            "mean_input_tokens": df["total_input_tokens"] / column("completed"),
+            "mean_output_tokens": df["total_output_tokens"] / column("completed"),
+        },
+        columns=DATASET_DIMENSIONS,
+    )
+    data = data.replace([np.inf, -np.inf], np.nan).round(6)
+    # NaN 不是合法的 JSON，转成 null
+    data = data.astype(object).where(data.notna(), None)
+    groups = dict(list(data.groupby(df["_endpoint_name"], sort=False)))
+    return [
+        {
+            "id": endpoint,
+            "dimensions": DATASET_DIMENSIONS,
+            "source": groups[endpoint].values.tolist(),
+        }
+        for endpoint in endpoints
+    ]
+
+
+def bubble_charts(df):
+    """闭环压测结果按并发绘图：ITL、TTFT、E2E 气泡图和各项指标的折线图，返回 (图表列表, 每个 endpoint 的 dataset)。
+    图表不内联数据，series 通过 datasetIndex 引用共享的 dataset"""
+    # 获取所有唯一的分组和端点名称
+    endpoints = df["_endpoint_name"].unique().tolist()
+    df = df.sort_values("max_concurrency", kind="stable")
+    datasets = endpoint_datasets(df, endpoints)
+
+    # 计算 request_throughput * _throughput_scale 的范围
+    throughput_scaled = df["request_throughput"] * df["_throughput_scale"]
+    throughput_scaled = throughput_scaled.replace(
+        [float("inf"), -float("inf")], float("nan")
+    ).dropna()
+    if throughput_scaled.empty:
+        raise ValueError("No valid throughput data after filtering")
+    visual_map_min = max(throughput_scaled.min(), 1e-6)  # 避免 min 为 0
+    visual_map_max = throughput_scaled.max()
+
+    def dataset_series(series_type, y):
+        return [
+            {
+                "name": endpoint,
+                "type": series_type,
+                "datasetIndex": index,
+                "encode": {"x": "max_concurrency", "y": y},
+            }
+            for index, endpoint in enumerate(endpoints)
+        ]
+
+    # 生成 ECharts 配置
+    charts = []
+
+    # 图表 1-3: 平均 ITL、TTFT、E2E 延迟气泡图，气泡大小为 QPS/GPU
+    for title, y_name, y in [
+        ("平均 ITL (Inter-Token Latency)", "平均 ITL (ms)", "mean_itl_ms"),
+        ("平均 TTFT (Time to First Token)", "平均 TTFT (s)", "mean_ttft_s"),
+        ("平均 E2E 延迟", "平均 E2E 延迟 (s)", "mean_e2e_latency_s"),
+    ]:
+        charts.append(
+            {
+                "title": {"text": title, "left": "center"},
+                "legend": {
+                    "top": 30,
+                    "data": endpoints,
+                },
+                "grid": {"top": 100, "left": 140},
+                "tooltip": {"trigger": "item"},  # Formatter will be set in JavaScript
+                "xAxis": {"name": "并发", "type": "value"},
+                "yAxis": {"name": y_name, "type": "value"},
+                "sharedDataset": True,
+                "series": dataset_series("scatter", y),
+                "visualMap": {
+                    "top": 30,
+                    "itemWidth": 25,
+                    "text": ["气泡大小\n(QPS/GPU)"],
+                    "textGap": 20,
+                    "calculable": True,
+                    "precision": 0.1,
+                    "inRange": {"symbolSize": [5, 70]},
+                    "min": visual_map_min,
+                    "max": visual_map_max,
+                    "dimension": DATASET_DIMENSIONS.index("qps_per_gpu"),
+                },
+            }
+        )
+
+    # 其他折线图
+    metrics = [
+        ("request_throughput", "QPS (未平均到 GPU)", "吞吐(QPS)"),
+        ("input_throughput", "输入Token吞吐", "吞吐(token/s)"),
+        ("output_throughput", "生成Token吞吐", "吞吐(token/s)"),
+        ("concurrency", "服务端并发", "服务端并发"),
+        ("total_io_throughput", "总Token吞吐", "吞吐(token/s)"),
+        ("total_input_tokens", "总输入Token数", "Tokens"),
+        ("total_output_tokens", "总生成Token数", "Tokens"),
+        ("completed", "完成请求数", "Requests"),
+        ("mean_input_tokens", "单请求平均输入Token数", "Tokens"),
+        ("mean_output_tokens", "单请求平均生成Token数", "Tokens"),
+    ]
+
+    for metric, title, y_axis_name in metrics:
+        charts.append(
+            {
+                "title": {"text": f"{title}", "left": "center"},
+                "legend": {
+                    "top": 30,
+                    "data": endpoints,
+                },
+                "grid": {"top": 60, "left": 140},
+                "tooltip": {"trigger": "axis"},
+                "xAxis": {"name": "并发", "type": "value"},
+                "yAxis": {"name": y_axis_name, "type": "value"},
+                "sharedDataset": True,
+                "series": dataset_series("line", metric),
+            }
+        )
+    return charts, datasets
+
+
+WORKLOAD_AXIS_NAMES = {
+    "input_len": "输入长度 (tokens)",
+    "output_len": "输出长度 (tokens)",
+    "prefix_ratio": "共享前缀比例",
+}
+
+
+def workload_charts(df, x_key, x_name):
+    """负载矩阵的分面图：各负载组合下每个 endpoint 的峰值吞吐和最低负载时的延迟柱状图，负载组合按单请求
+    输入/输出 token 比从 decode-heavy 到 prefill-heavy 排列；以及峰值 QPS/GPU 随每个矩阵轴变化的折线图"""
+    if "_workload" not in df.columns:
+        return []
+    df = df[df["_workload"].notna()]
+    if df.empty:
+        return []
+    stats = []
+    for _, group in df.groupby("_endpoint_name", sort=False):
+        cell = group["_workload"].iloc[0]
+        scale = group["_throughput_scale"]
+        low = group.loc[group[x_key].idxmin()]
+        stats.append(
+            {
+                "endpoint": group["_endpoint_base"].iloc[0],
+                "cell": cell,
+                "io_ratio": group["total_input_tokens"].sum()
+                / max(group["total_output_tokens"].sum(), 1),
+                "peak_qps_per_gpu": (group["request_throughput"] * scale).max(),
+                "peak_input_per_gpu": (group["input_throughput"] * scale).max(),
+                "peak_output_per_gpu": (group["output_throughput"] * scale).max(),
+                "low_ttft_s": low["mean_ttft_ms"] / 1000,
+                "low_itl_ms": low["mean_itl_ms"],
+            }
+        )
+    endpoints = list(dict.fromkeys(stat["endpoint"] for stat in stats))
+    io_ratios = defaultdict(list)
+    for stat in stats:
+        io_ratios[stat["cell"]["name"]].append(stat["io_ratio"])
+    cells = sorted(io_ratios, key=lambda name: np.mean(io_ratios[name]))
+    labels = [f"{name}\n(in:out {np.mean(io_ratios[name]):.2g})" for name in cells]
+
+    def value(metric, endpoint, cell):
+        for stat in stats:
+            if stat["endpoint"] == endpoint and stat["cell"]["name"] == cell:
+                return None if math.isnan(stat[metric]) else round(stat[metric], 4)
+        return None
 
+    charts = []
+    for metric, title, y_name in [
+        ("peak_qps_per_gpu", "各负载峰值 QPS/GPU", "QPS/GPU"),
+        ("peak_input_per_gpu", "各负载峰值输入Token吞吐/GPU", "吞吐(token/s)"),
+        ("peak_output_per_gpu", "各负载峰值生成Token吞吐/GPU", "吞吐(token/s)"),
+        ("low_ttft_s", f"各负载{x_name}最低时的平均 TTFT", "平均 TTFT (s)"),
+        ("low_itl_ms", f"各负载{x_name}最低时的平均 ITL", "平均 ITL (ms)"),
+    ]:
+        charts.append(
+            {
+                "title": {"text": title, "left": "center"},
+                "legend": {"top": 30, "type": "scroll", "data": endpoints},
+                "grid": {"top": 60, "left": 140},
+                "tooltip": {"trigger": "axis"},
+                "xAxis": {
+                    "name": "decode-heavy → prefill-heavy",
+                    "nameLocation": "middle",
+                    "nameGap": 45,
+                    "type": "category",
+                    "data": labels,
+                },
+                "yAxis": {"name": y_name, "type": "value"},
+                "series": [
+                    {
+                        "name": endpoint,
+                        "type": "bar",
+                        "data": [value(metric, endpoint, cell) for cell in cells],
+                    }
+                    for endpoint in endpoints
+                ],
+            }
+        )
 
-def benchmark_target(job_arg):
-    job_id, sglang_bench_cmd, endpoint, concurrencies, repeats, verbose = job_arg
-    endpoint_name = get_endpoint_name(endpoint)
-    output_file = f"{endpoint_name}.bench"
-    if os.path.isfile(output_file):
-        os.remove(output_file)
+    # 每个有多个取值的轴画一张折线图，其余轴取值相同的组合连成一条线
+    axes = stats[0]["cell"]["axes"]
+    for axis, axis_name in WORKLOAD_AXIS_NAMES.items():
+        if axis not in axes or len({stat["cell"][axis] for stat in stats} - {None}) < 2:
+            continue
+        lines = defaultdict(list)
+        for stat in stats:
+            cell = stat["cell"]
+            if cell[axis] is None or math.isnan(stat["peak_qps_per_gpu"]):
+                continue
+            rest = workload_cell_name(cell, [other for other in axes if other != axis])
+            line = f"{stat['endpoint']} [{rest}]" if rest else stat["endpoint"]
+            lines[line].append([cell[axis], round(stat["peak_qps_per_gpu"], 4)])
+        charts.append(
+            line_chart_option(
+                f"峰值 QPS/GPU 随{axis_name.split(' ')[0]}的变化",
+                axis_name,
+                "QPS/GPU",
+                [
+                    {"name": line, "type": "line", "data": sorted(points)}
+                    for line, points in lines.items()
+                ],
+            )
+        )
+    return charts
 
-    if isinstance(repeats, list):
-        total_requests = sum(
-            concur * repeat for concur, repeat in zip(concurrencies, repeats)
+
+def result_files(bench_config=None):
+    """返回 (.bench 结果文件列表, .adaptive.json 文件列表, .metrics.jsonl 文件列表)，有压测配置时只取配置中的 endpoint"""
+    if not bench_config:
+        return (
+            glob.glob("*.bench"),
+            glob.glob("*.adaptive.json"),
+            glob.glob("*.metrics.jsonl"),
         )
-    else:
-        total_requests = sum(concurrencies) * repeats
+    bench_results = []
+    adaptive_results = []
+    metrics_results = []
+    for endpoint in [
+        target
+        for endpoint in bench_config["endpoints"]
+        for target in workload_endpoints(bench_config, endpoint)
+    ]:
+        endpoint_name = get_endpoint_name(endpoint)
+        fname = f"{endpoint_name}.bench"
+        if os.path.isfile(fname):
+            bench_results.append(fname)
+        if os.path.isfile(f"{endpoint_name}.adaptive.json"):
+            adaptive_results.append(f"{endpoint_name}.adaptive.json")
+        if os.path.isfile(f"{endpoint_name}.metrics.jsonl"):
+            metrics_results.append(f"{endpoint_name}.metrics.jsonl")
+    return bench_results, adaptive_results, metrics_results
 
-    process_bar = tqdm(
-        total=total_requests, desc=f"{endpoint_name}", position=job_id, unit=" req"
+
+# /get_server_info 的 (连接, 读取) 超时秒数和重试次数。读超时说明服务卡住了，不再重试，一个 endpoint 最慢约 20 秒
+SERVER_INFO_TIMEOUT = (3, 10)
+SERVER_INFO_RETRIES = 2
+
+
+def http_session(pool_size=1, retries=SERVER_INFO_RETRIES):
+    """带连接池的 requests.Session，GET 请求遇到连接错误和 5xx 时按指数退避重试，读超时不重试"""
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET"],
     )
-    for i, concurrency in enumerate(concurrencies):
-        repeat = repeats[i] if isinstance(repeats, list) else repeats
-        process_bar.set_postfix(
-            {"case": f'"concur {concurrency} req repeat {repeat} times"'}
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_server_info(session, endpoint, api_key):
+    """获取一个 endpoint 的 /get_server_info，获取不到时返回 None"""
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    try:
+        res = session.get(
+            endpoint["base_url"] + "/get_server_info",
+            headers=headers,
+            timeout=SERVER_INFO_TIMEOUT,
         )
-        benchmark_one(sglang_bench_cmd, endpoint, concurrency, repeat, verbose)
-        process_bar.update(concurrency * repeat)
+        if res.status_code == 200:
+            return res.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Warning: Failed to get server info of {endpoint['base_url']}: {e}")
+    return None
 
 
-def run_benchmark(bench_config, parallel_jobs, verbose=False):
-    if "repeats" in bench_config:
-        repeats = bench_config["repeats"]
-        if isinstance(repeats, list):
-            assert len(bench_config["repeats"]) == len(
-                bench_config["concurs"]
-            ), "'repeats' list and 'concurs' list should have the same size"
+def cached_server_info(endpoint_names=None):
+    """读取 {endpoint_name}.server_info.json 缓存，endpoint_names 为 None 时读取当前目录下所有的缓存"""
+    if endpoint_names is None:
+        files = sorted(glob.glob("*.server_info.json"))
     else:
-        repeats = 10
-    base_urls = set()
-    names = set()
-    for ep in bench_config["endpoints"]:
-        assert ep["base_url"] not in base_urls, f"Duplicate endpoint.base_url {ep}"
-        base_urls.add(ep["base_url"])
-        if "name" in ep and ep["name"] is not None:
-            assert ep["name"] not in names, f"Duplicate endpoint.name {ep}"
-            names.add(ep["name"])
-    if "api_key" in bench_config and bench_config["api_key"] is not None:
-        bench_config["sglang_bench_cmd"].insert(0, f"OPENAI_API_KEY={bench_config['api_key']}")
+        files = [
+            f"{endpoint_name}.server_info.json" for endpoint_name in endpoint_names
+        ]
+    endpoint_serverinfo = {}
+    for file in files:
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                endpoint_serverinfo[file[: -len(".server_info.json")]] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return endpoint_serverinfo
 
-    print(
-        "BubbleBenchmarking for endpoints: "
-        + ", ".join([get_endpoint_name(v) for v in bench_config["endpoints"]])
-    )
-    jobs = [
-        (
-            job_id,
-            bench_config["sglang_bench_cmd"],
-            endpoint,
-            bench_config["concurs"],
-            repeats,
-            verbose,
+
+def get_server_info(bench_config):
+    """用共享连接池并发获取各 endpoint 的 /get_server_info，耗时取决于最慢的一个 endpoint。
+    获取成功的结果缓存到压测结果旁边的 {endpoint_name}.server_info.json，获取不到时使用缓存，不影响报告生成"""
+    endpoints = bench_config["endpoints"]
+    api_key = bench_config.get("api_key")
+    if not endpoints:
+        return {}
+    with http_session(len(endpoints)) as session, ThreadPoolExecutor(
+        max_workers=min(len(endpoints), 64)
+    ) as executor:
+        infos = list(
+            executor.map(
+                lambda endpoint: fetch_server_info(session, endpoint, api_key),
+                endpoints,
+            )
         )
-        for job_id, endpoint in enumerate(bench_config["endpoints"])
-    ]
-    with Pool(processes=parallel_jobs) as pool:
-        pool.map(benchmark_target, jobs)
+    endpoint_serverinfo = {}
+    for endpoint, info in zip(endpoints, infos):
+        endpoint_name = get_endpoint_name(endpoint)
+        if info is None:
+            info = cached_server_info([endpoint_name]).get(endpoint_name)
+            if info is None:
+                continue
+        else:
+            # TODO 当 tp_size 与 throughput_scale 冲突时，报个错
+            with open(f"{endpoint_name}.server_info.json", "w") as f:
+                json.dump(info, f, indent=2)
+        endpoint_serverinfo[endpoint_name] = info
+    return endpoint_serverinfo
 
 
-def gen_report(bench_config=None):
-    # 存储数据的字典
-    data = defaultdict(list)
-    bench_results = []
+# 压测脚本执行环境的缓存，和压测结果放在同一目录
+ENV_INFO_FILE = "bubble_bench_env.json"
 
-    endpoint_serverinfo = {}
-    if bench_config:
-        for endpoint in bench_config["endpoints"]:
-            endpoint_name = get_endpoint_name(endpoint)
-            fname = f"{endpoint_name}.bench"
-            if os.path.isfile(fname):
-                bench_results.append(fname)
-            # 这部分信息允许获取不到，不影响报告生成
-            try:
-                url = endpoint["base_url"] + "/get_server_info"
-                if "api_key" in bench_config and bench_config["api_key"] is not None:
-                    res = requests.get(
-                        url,
-                        headers={"Authorization": f"Bearer {bench_config['api_key']}"},
-                    )
-                else:
-                    res = requests.get(url)
-                if res.status_code == 200:
-                    res_data = json.loads(res.text)
-                    # TODO 当 tp_size 与 throughput_scale 冲突时，报个错
-                    endpoint_serverinfo[endpoint_name] = res_data
-            except:
-                pass
-    else:
-        bench_results = glob.glob("*.bench")
 
-    # 读取并解析所有 JSON 数据
-    data = []
-    for file in bench_results:
-        with open(file, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    json_data = json.loads(line.strip())
-                    data.append(json_data)
-                except json.JSONDecodeError as e:
-                    print(f"Warning: Failed to parse line in {file}: {e}")
-    system_info = ""
-    if bench_config:
-        system_info += "压测配置:\n" + json.dumps(bench_config, indent=2) + "\n\n"
-    if len(endpoint_serverinfo) > 0:
-        system_info += (
-            "压测目标服务器信息:\n" + json.dumps(endpoint_serverinfo, indent=2) + "\n\n"
-        )
-    
+def get_env_info(refresh=False):
+    """压测脚本执行环境的描述。collect_env 要 import torch 并执行 pip list，耗时数秒，所以每次压测开始时
+    refresh 一次并缓存到 ENV_INFO_FILE，之后生成报告都直接读取缓存"""
+    if not refresh:
+        try:
+            with open(ENV_INFO_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)["env_info"]
+        except (OSError, ValueError, KeyError):
+            pass
+    from torch.utils import collect_env
+
     env_info = collect_env.get_env_info()
     # CPU 信息太啰嗦了，这里精简一下
     cpu_info_lines = env_info.cpu_info.splitlines()
@@ -260,11 +2809,98 @@ def gen_report(bench_config=None):
         cudnn_version=None,
         pip_packages=pip_list_output + env_info.pip_packages,
     )
+    env_info = collect_env.pretty_str(env_info)
+    with open(ENV_INFO_FILE, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": time.time(), "env_info": env_info}, f, indent=2)
+    return env_info
+
+
+def report_system_info(bench_config, endpoint_serverinfo, adaptive_results, env_info):
+    """报告中折叠展示的压测配置、服务器信息、自适应扫描结果和执行环境"""
+    system_info = ""
+    if bench_config:
+        system_info += "压测配置:\n" + json.dumps(bench_config, indent=2) + "\n\n"
+    if len(endpoint_serverinfo) > 0:
+        system_info += (
+            "压测目标服务器信息:\n" + json.dumps(endpoint_serverinfo, indent=2) + "\n\n"
+        )
+    adaptive_summaries = {}
+    for file in sorted(adaptive_results):
+        with open(file, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+        adaptive_summaries[summary.pop("_endpoint_name")] = summary
+    if len(adaptive_summaries) > 0:
+        system_info += (
+            "自适应扫描结果（SLO 内最大 QPS/GPU）:\n"
+            + json.dumps(adaptive_summaries, indent=2)
+            + "\n\n"
+        )
     system_info += "压测脚本执行环境:\n"
-    system_info += collect_env.pretty_str(env_info)
+    system_info += env_info
+    return system_info
+
+
+class ResultStore:
+    """增量读取 .bench 结果文件：记录每个文件已经解析到的位置，每次只解析新追加的完整行"""
+
+    def __init__(self):
+        # file -> (文件开头的若干字节, 已解析的字节数)，文件开头变了说明文件被删除重建
+        self.positions = {}
+        # file -> 已解析的结果列表
+        self.results = {}
+
+    def update(self, files):
+        """读取 files 中新追加的结果，返回结果是否有变化"""
+        changed = False
+        for file in [file for file in self.results if file not in files]:
+            del self.results[file]
+            del self.positions[file]
+            changed = True
+        for file in files:
+            try:
+                f = open(file, "rb")
+            except OSError:
+                continue
+            with f:
+                head, offset = self.positions.get(file, (b"", 0))
+                size = os.fstat(f.fileno()).st_size
+                if size < offset or f.read(len(head)) != head:
+                    # 重新压测时结果文件会被删除重建
+                    head, offset = b"", 0
+                    self.results[file] = []
+                    changed = True
+                rows = self.results.setdefault(file, [])
+                if size == offset:
+                    continue
+                f.seek(offset)
+                data = f.read(size - offset)
+            # 只解析完整的行，正在写入的行留到下次
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    print(f"Warning: Failed to parse line in {file}: {e}")
+            if offset == 0:
+                head = data[: min(end, 256)]
+            self.positions[file] = (head, offset + end)
+            changed = changed or end > 0
+        return changed
+
+    def rows(self):
+        return [row for rows in self.results.values() for row in rows]
+
+
+def build_charts(rows, bench_config=None, sample_cache=None, metrics_rows=None):
+    """根据压测结果生成所有图表的 ECharts 配置，返回 {"charts": 图表列表, "bubble_count": 开头的气泡图个数,
+    "datasets": 闭环压测结果每个 endpoint 一个 dataset，由 sharedDataset 的图表共享}"""
+    # pandas import 较慢，只在生成报告时 import
+    import pandas as pd
 
     # 转换为 DataFrame
-    df = pd.DataFrame(data)
+    df = pd.DataFrame(rows)
 
     # 确保所需字段存在
     required_fields = [
@@ -294,255 +2930,146 @@ def gen_report(bench_config=None):
     if missing_fields:
         raise ValueError(f"Missing required fields in data: {missing_fields}")
 
-    # 获取所有唯一的分组和端点名称
-    endpoints = df["_endpoint_name"].unique().tolist()
-    max_concurrencies = [
-        int(x) for x in sorted(df["max_concurrency"].unique().tolist())
-    ]
+    max_points = (bench_config or {}).get("report_max_points", 1000)
 
-    # 生成 ECharts 配置
-    charts = []
+    # 闭环（按并发）和开环（按 QPS）的压测结果分别绘图
+    if "offered_qps" in df.columns:
+        open_df = df[df["offered_qps"].notna()]
+        df = df[df["offered_qps"].isna()]
+    else:
+        open_df = df.iloc[0:0]
+    charts, datasets = bubble_charts(df) if not df.empty else ([], [])
+    # 前 3 个气泡图使用下面的 tooltip formatter
+    bubble_count = 3 if charts else 0
+    if not open_df.empty:
+        charts += open_loop_charts(open_df)
 
-    # 计算 request_throughput * _throughput_scale 的范围
-    throughput_scaled = df["request_throughput"] * df["_throughput_scale"]
-    throughput_scaled = throughput_scaled.replace(
-        [float("inf"), -float("inf")], float("nan")
-    ).dropna()
-    if throughput_scaled.empty:
-        raise ValueError("No valid throughput data after filtering")
-    visual_map_min = max(throughput_scaled.min(), 1e-6)  # 避免 min 为 0
-    visual_map_max = throughput_scaled.max()
+    # 负载矩阵按负载组合对比各 endpoint
+    if not df.empty:
+        charts += workload_charts(df, "max_concurrency", "并发")
+    if not open_df.empty:
+        charts += workload_charts(open_df, "offered_qps", "请求到达率")
 
-    # 图表 1: mean_itl_ms 气泡图
-    scatter_itl = {
-        "title": {"text": "平均 ITL (Inter-Token Latency)", "left": "center"},
-        "legend": {
-            "top": 30,
-            "data": endpoints,
-        },
-        "grid": {"top": 100, "left": 140},
-        "tooltip": {"trigger": "item"},  # Formatter will be set in JavaScript
-        "xAxis": {"name": "并发", "type": "value", "data": max_concurrencies},
-        "yAxis": {"name": "平均 ITL (ms)", "type": "value"},
-        "series": [],
-        "visualMap": {
-            "top": 30,
-            "itemWidth": 25,
-            "text": ["气泡大小\n(QPS/GPU)"],
-            "textGap": 20,
-            "calculable": True,
-            "precision": 0.1,
-            "inRange": {"symbolSize": [5, 70]},
-            "min": visual_map_min,
-            "max": visual_map_max,
-            "dimension": 6,
-        },
-    }
-    for endpoint in endpoints:
-        endpoint_data = df[df["_endpoint_name"] == endpoint]
-        series_data = [
-            [
-                row["max_concurrency"],
-                row["mean_itl_ms"],
-                row["median_itl_ms"],
-                row["p95_itl_ms"],
-                row["p99_itl_ms"],
-                row["std_itl_ms"],
-                row["request_throughput"] * row["_throughput_scale"],
-            ]
-            for _, row in endpoint_data.iterrows()
-        ]
-        scatter_itl["series"].append(
-            {"name": endpoint, "type": "scatter", "data": series_data}
-        )
-    charts.append(scatter_itl)
+    # 根据原始样本计算任意分位数、CDF 和直方图
+    samples = load_samples(df, sample_cache)
+    if samples:
+        percentiles = (bench_config or {}).get("report_percentiles", [50, 90, 99, 99.9])
+        charts += sample_charts(samples, percentiles, max_points)
 
-    # 图表 2: mean_ttft_ms 气泡图
-    scatter_ttft = {
-        "title": {"text": "平均 TTFT (Time to First Token)", "left": "center"},
-        "legend": {
-            "top": 30,
-            "data": endpoints,
-        },
-        "grid": {"top": 100, "left": 140},
-        "tooltip": {"trigger": "item"},
-        "xAxis": {"name": "并发", "type": "value", "data": max_concurrencies},
-        "yAxis": {"name": "平均 TTFT (s)", "type": "value"},
-        "series": [],
-        "visualMap": {
-            "top": 30,
-            "itemWidth": 25,
-            "text": ["气泡大小\n(QPS/GPU)"],
-            "textGap": 20,
-            "calculable": True,
-            "precision": 0.1,
-            "inRange": {"symbolSize": [5, 70]},
-            "min": visual_map_min,
-            "max": visual_map_max,
-            "dimension": 5,
-        },
-    }
-    for endpoint in endpoints:
-        endpoint_data = df[df["_endpoint_name"] == endpoint]
-        series_data = [
-            [
-                row["max_concurrency"],
-                row["mean_ttft_ms"] / 1000,
-                row["median_ttft_ms"] / 1000,
-                row["p99_ttft_ms"] / 1000,
-                row["std_ttft_ms"] / 1000,
-                row["request_throughput"] * row["_throughput_scale"],
-            ]
-            for _, row in endpoint_data.iterrows()
-        ]
-        scatter_ttft["series"].append(
-            {"name": endpoint, "type": "scatter", "data": series_data}
+    # 服务端 /metrics 时间序列，闭环和开环分别与对应的压测结果关联
+    if metrics_rows:
+        charts += server_metrics_charts(
+            df,
+            [row for row in metrics_rows if "offered_qps" not in row],
+            "max_concurrency",
+            "并发",
         )
-    charts.append(scatter_ttft)
-
-    # 图表 3: mean_e2e_latency_ms 气泡图
-    scatter_e2e = {
-        "title": {"text": "平均 E2E 延迟", "left": "center"},
-        "legend": {
-            "top": 30,
-            "data": endpoints,
-        },
-        "grid": {"top": 100, "left": 140},
-        "tooltip": {"trigger": "item"},
-        "xAxis": {"name": "并发", "type": "value", "data": max_concurrencies},
-        "yAxis": {"name": "平均 E2E 延迟 (s)", "type": "value"},
-        "series": [],
-        "visualMap": {
-            "top": 30,
-            "itemWidth": 25,
-            "text": ["气泡大小\n(QPS/GPU)"],
-            "textGap": 20,
-            "calculable": True,
-            "precision": 0.1,
-            "inRange": {"symbolSize": [5, 70]},
-            "min": visual_map_min,
-            "max": visual_map_max,
-            "dimension": 4,
-        },
-    }
-    for endpoint in endpoints:
-        endpoint_data = df[df["_endpoint_name"] == endpoint]
-        series_data = [
-            [
-                row["max_concurrency"],
-                row["mean_e2e_latency_ms"] / 1000,
-                row["median_e2e_latency_ms"] / 1000,
-                row["p99_e2e_latency_ms"] / 1000,
-                row["request_throughput"] * row["_throughput_scale"],
-            ]
-            for _, row in endpoint_data.iterrows()
-        ]
-        scatter_e2e["series"].append(
-            {"name": endpoint, "type": "scatter", "data": series_data}
+        charts += server_metrics_charts(
+            open_df,
+            [row for row in metrics_rows if "offered_qps" in row],
+            "offered_qps",
+            "请求到达率 (QPS)",
         )
-    charts.append(scatter_e2e)
+    compact_charts(charts, max_points)
+    return {"charts": charts, "bubble_count": bubble_count, "datasets": datasets}
 
-    # 其他折线图
-    metrics = [
-        ("request_throughput", "QPS (未平均到 GPU)", "吞吐(QPS)"),
-        ("input_throughput", "输入Token吞吐", "吞吐(token/s)"),
-        ("output_throughput", "生成Token吞吐", "吞吐(token/s)"),
-        ("concurrency", "服务端并发", "服务端并发"),
-        ("total_io_throughput", "总Token吞吐", "吞吐(token/s)"),
-        ("total_input_tokens", "总输入Token数", "Tokens"),
-        ("total_output_tokens", "总生成Token数", "Tokens"),
-        ("completed", "完成请求数", "Requests"),
-        ("mean_input_tokens", "单请求平均输入Token数", "Tokens"),
-        ("mean_output_tokens", "单请求平均生成Token数", "Tokens"),
-    ]
 
-    for metric, title, y_axis_name in metrics:
-        line_chart = {
-            "title": {"text": f"{title}", "left": "center"},
-            "legend": {
-                "top": 30,
-                "data": endpoints,
-            },
-            "grid": {"top": 60, "left": 140},
-            "tooltip": {"trigger": "axis"},
-            "xAxis": {"name": "并发", "type": "value", "data": max_concurrencies},
-            "yAxis": {"name": y_axis_name, "type": "value"},
-            "series": [],
-        }
-        for endpoint in endpoints:
-            endpoint_data = df[df["_endpoint_name"] == endpoint].sort_values(
-                "max_concurrency"
-            )
-            if metric == "total_io_throughput":
-                values = (
-                    endpoint_data["input_throughput"]
-                    + endpoint_data["output_throughput"]
-                ).tolist()
-            elif metric == "mean_input_tokens":
-                values = (
-                    endpoint_data["total_input_tokens"] / endpoint_data["completed"]
-                ).tolist()
-            elif metric == "mean_output_tokens":
-                values = (
-                    endpoint_data["total_output_tokens"] / endpoint_data["completed"]
-                ).tolist()
-            else:
-                values = endpoint_data[metric].tolist()
-            series_data = [
-                [int(row["max_concurrency"]), round(float(row["value"]), 2)]
-                for _, row in endpoint_data[["max_concurrency"]]
-                .assign(value=values)
-                .iterrows()
-            ]
-            line_chart["series"].append(
-                {"name": endpoint, "type": "line", "data": series_data}
+def render_report(system_info, report, live=False, echarts_js=None):
+    """生成报告 HTML，live 为 True 时页面通过 SSE 接收实时更新的图表。
+    echarts_js 为本地 echarts.min.js 的路径时将其内联到页面中，报告不需要联网就能打开"""
+    if echarts_js:
+        with open(echarts_js, "r", encoding="utf-8") as f:
+            # 避免 bundle 中的字符串提前结束 <script> 标签
+            echarts_script = "<script>{}</script>".format(
+                f.read().replace("</script", "<\\/script")
             )
-        charts.append(line_chart)
+    else:
+        echarts_script = '<script src="https://fastly.jsdelivr.net/npm/echarts@5/dist/echarts.min.js"></script>'
 
     # 定义 JavaScript formatter 函数
     formatter_js = """
+    // 置信区间，early_stop 模式之外的结果没有置信区间，不展示
+    function ci(low, high) {
+        if (low == null || high == null || isNaN(low) || isNaN(high)) {
+            return '';
+        }
+        return ` [${low.toFixed(2)}, ${high.toFixed(2)}]`;
+    }
+    // 解码 base64 编码的 Float32Array 折线数据，float32 只有约 7 位有效数字，多余的位数截掉
+    function decodeSeries(option) {
+        (option.series || []).forEach(serie => {
+            if (serie.data && serie.data.f32) {
+                const bytes = Uint8Array.from(atob(serie.data.f32), c => c.charCodeAt(0));
+                const values = new Float32Array(bytes.buffer);
+                const data = [];
+                for (let i = 0; i + 1 < values.length; i += 2) {
+                    data.push([+values[i].toPrecision(6), +values[i + 1].toPrecision(6)]);
+                }
+                serie.data = data;
+            }
+        });
+    }
+    // 气泡图的数据是 dataset 的一行，按列名取值
+    function row(params) {
+        const v = {};
+        DIMENSIONS.forEach((name, i) => { v[name] = params.value[i]; });
+        return v;
+    }
     const formatters = [
         // Formatter for 平均 ITL
         function(params) {
-            var v = params.value;
+            var v = row(params);
             return `
                 Endpoint: ${params.seriesName}<br/>
-                并发: ${v[0].toFixed(2)}<br/>
-                平均 ITL: ${v[1].toFixed(2)} ms<br/>
-                中位数 ITL: ${v[2].toFixed(2)} ms<br/>
-                P95 ITL: ${v[3].toFixed(2)} ms<br/>
-                P99 ITL: ${v[4].toFixed(2)} ms<br/>
-                标准差 ITL: ${v[5].toFixed(2)} ms<br/>
-                QPS/GPU: ${v[6].toFixed(2)}
+                并发: ${v.max_concurrency.toFixed(2)}<br/>
+                平均 ITL: ${v.mean_itl_ms.toFixed(2)} ms<br/>
+                中位数 ITL: ${v.median_itl_ms.toFixed(2)} ms<br/>
+                P95 ITL: ${v.p95_itl_ms.toFixed(2)} ms<br/>
+                P99 ITL: ${v.p99_itl_ms.toFixed(2)} ms${ci(v.p99_itl_ms_ci_low, v.p99_itl_ms_ci_high)}<br/>
+                标准差 ITL: ${v.std_itl_ms.toFixed(2)} ms<br/>
+                QPS/GPU: ${v.qps_per_gpu.toFixed(2)}${ci(v.qps_per_gpu_ci_low, v.qps_per_gpu_ci_high)}
             `;
         },
         // Formatter for 平均 TTFT
         function(params) {
-            var v = params.value;
+            var v = row(params);
             return `
                 Endpoint: ${params.seriesName}<br/>
-                并发: ${v[0].toFixed(2)}<br/>
-                平均 TTFT: ${v[1].toFixed(2)} s<br/>
-                中位数 TTFT: ${v[2].toFixed(2)} s<br/>
-                P99 TTFT: ${v[3].toFixed(2)} s<br/>
-                标准差 TTFT: ${v[4].toFixed(2)} s<br/>
-                QPS/GPU: ${v[5].toFixed(2)}
+                并发: ${v.max_concurrency.toFixed(2)}<br/>
+                平均 TTFT: ${v.mean_ttft_s.toFixed(2)} s<br/>
+                中位数 TTFT: ${v.median_ttft_s.toFixed(2)} s<br/>
+                P99 TTFT: ${v.p99_ttft_s.toFixed(2)} s${ci(v.p99_ttft_s_ci_low, v.p99_ttft_s_ci_high)}<br/>
+                标准差 TTFT: ${v.std_ttft_s.toFixed(2)} s<br/>
+                QPS/GPU: ${v.qps_per_gpu.toFixed(2)}${ci(v.qps_per_gpu_ci_low, v.qps_per_gpu_ci_high)}
             `;
         },
         // Formatter for 平均 E2E 延迟
         function(params) {
-            var v = params.value;
+            var v = row(params);
             return `
                 Endpoint: ${params.seriesName}<br/>
-                并发: ${v[0].toFixed(2)}<br/>
-                平均 E2E 延迟: ${v[1].toFixed(2)} s<br/>
-                中位数 E2E 延迟: ${v[2].toFixed(2)} s<br/>
-                P99 E2E 延迟: ${v[3].toFixed(2)} s<br/>
-                QPS/GPU: ${v[4].toFixed(2)}
+                并发: ${v.max_concurrency.toFixed(2)}<br/>
+                平均 E2E 延迟: ${v.mean_e2e_latency_s.toFixed(2)} s<br/>
+                中位数 E2E 延迟: ${v.median_e2e_latency_s.toFixed(2)} s<br/>
+                P99 E2E 延迟: ${v.p99_e2e_latency_s.toFixed(2)} s<br/>
+                QPS/GPU: ${v.qps_per_gpu.toFixed(2)}
             `;
         }
     ];
-    """
+    """.replace("DIMENSIONS", json.dumps(DATASET_DIMENSIONS))
+
+    live_js = ""
+    if live:
+        live_js = """
+            // 实时报告：服务端每完成一个压测 case 推送一次最新的图表
+            const source = new EventSource('events');
+            source.onmessage = function(event) {
+                const report = JSON.parse(event.data);
+                document.querySelector('#system_info pre').textContent = report.system_info;
+                renderCharts(report);
+            };
+            source.addEventListener('done', () => source.close());
+        """
 
     # 生成 HTML 文件
     html_content = f"""
@@ -551,7 +3078,7 @@ def gen_report(bench_config=None):
     <head>
         <meta charset="utf-8" />
         <title>Bubble Bench Charts</title>
-        <script src="https://fastly.jsdelivr.net/npm/echarts@5/dist/echarts.min.js"></script>
+        {echarts_script}
         <style>
             body {{ margin-right: 15px; padding: 0;}}
             .chart {{ width: 100%; height: 400px; margin-bottom: 20px; box-sizing: border-box; }}
@@ -580,43 +3107,9 @@ def gen_report(bench_config=None):
                 button.textContent = content.classList.contains('expanded') ? '▲' : '▼';
             }}
             {formatter_js}
-            const charts = {json.dumps(charts, indent=2, ensure_ascii=False)};
             const chartDoms = [];
             const chartContainer = document.getElementById('charts');
 
-            // 创建图表容器
-            charts.forEach((_, index) => {{
-                const div = document.createElement('div');
-                div.id = `chart${{index}}`;
-                div.className = 'chart';
-                chartContainer.appendChild(div);
-                chartDoms.push(echarts.init(div, null, {{renderer: 'canvas'}}));
-            }});
-
-            // 配置图表
-            charts.forEach((option, index) => {{
-                if (index < 3 && formatters[index]) {{
-                    option.tooltip.formatter = formatters[index];
-                }}
-                if (option.visualMap) {{
-                    option.visualMap.formatter = function (v) {{
-                        return v.toFixed(2);
-                    }};
-                }}
-                option.toolbox = {{ feature: {{ saveAsImage: {{}} }} }};
-                option.dataZoom = [
-                    {{ type: 'slider', xAxisIndex: 0, filterMode: 'none' }},
-                    {{
-                        type: 'inside',
-                        xAxisIndex: 0,
-                        filterMode: 'none',
-                        zoomOnMouseWheel: false, // 禁用滚轮缩放
-                        moveOnMouseWheel: false  // 禁用滚轮平移
-                    }}
-                ];
-                chartDoms[index].setOption(option);
-            }});
-
             // 防抖函数
             function debounce(fn, delay) {{
                 let timeout;
@@ -626,58 +3119,250 @@ def gen_report(bench_config=None):
                 }};
             }}
 
-            // 高亮联动
-            chartDoms.forEach(chart => {{
-                chart.on('mouseover', debounce(function(param) {{
-                    chartDoms.forEach(c => {{
-                        if (c !== chart) {{
+            // 绘制所有图表，实时报告每次收到新结果都整体重绘
+            function renderCharts(report) {{
+                const charts = report.charts;
+                chartDoms.forEach(chart => chart.dispose());
+                chartDoms.length = 0;
+                chartContainer.innerHTML = '';
+
+                // 创建图表容器
+                charts.forEach((_, index) => {{
+                    const div = document.createElement('div');
+                    div.id = `chart${{index}}`;
+                    div.className = 'chart';
+                    chartContainer.appendChild(div);
+                    chartDoms.push(echarts.init(div, null, {{renderer: 'canvas'}}));
+                }});
+
+                // 配置图表
+                charts.forEach((option, index) => {{
+                    decodeSeries(option);
+                    if (option.sharedDataset) {{
+                        option.dataset = report.datasets;
+                        delete option.sharedDataset;
+                    }}
+                    if (index < report.bubble_count && formatters[index]) {{
+                        option.tooltip.formatter = formatters[index];
+                    }}
+                    if (option.visualMap) {{
+                        option.visualMap.formatter = function (v) {{
+                            return v.toFixed(2);
+                        }};
+                    }}
+                    option.toolbox = {{ feature: {{ saveAsImage: {{}} }} }};
+                    option.dataZoom = [
+                        {{ type: 'slider', xAxisIndex: 0, filterMode: 'none' }},
+                        {{
+                            type: 'inside',
+                            xAxisIndex: 0,
+                            filterMode: 'none',
+                            zoomOnMouseWheel: false, // 禁用滚轮缩放
+                            moveOnMouseWheel: false  // 禁用滚轮平移
+                        }}
+                    ];
+                    chartDoms[index].setOption(option);
+                }});
+
+                // 高亮联动
+                chartDoms.forEach(chart => {{
+                    chart.on('mouseover', debounce(function(param) {{
+                        chartDoms.forEach(c => {{
+                            if (c !== chart) {{
+                                c.dispatchAction({{
+                                    type: 'highlight',
+                                    seriesIndex: param.seriesIndex,
+                                    dataIndex: param.dataIndex
+                                }});
+                            }}
+                        }});
+                    }}, 100));
+                    chart.on('mouseout', debounce(function(param) {{
+                        chartDoms.forEach(c => {{
                             c.dispatchAction({{
-                                type: 'highlight',
+                                type: 'downplay',
                                 seriesIndex: param.seriesIndex,
                                 dataIndex: param.dataIndex
                             }});
-                        }}
-                    }});
-                }}, 100));
-                chart.on('mouseout', debounce(function(param) {{
-                    chartDoms.forEach(c => {{
-                        c.dispatchAction({{
-                            type: 'downplay',
-                            seriesIndex: param.seriesIndex,
-                            dataIndex: param.dataIndex
                         }});
-                    }});
-                }}, 100));
-            }});
-
-            // dataZoom 同步
-            chartDoms.forEach((chart, index) => {{
-                chart.on('dataZoom', debounce(function(param) {{
-                    const option = chart.getOption();
-                    const dataZoom = option.dataZoom[0]; // 获取 slider 的 dataZoom 配置
-                    chartDoms.forEach((otherChart, otherIndex) => {{
-                        if (otherIndex !== index) {{
-                            otherChart.setOption({{
-                                dataZoom: [
-                                    {{ start: dataZoom.start, end: dataZoom.end }},
-                                    {{ start: dataZoom.start, end: dataZoom.end }}
-                                ]
-                            }});
-                        }}
-                    }});
-                }}, 100));
-            }});
+                    }}, 100));
+                }});
+
+                // dataZoom 同步
+                chartDoms.forEach((chart, index) => {{
+                    chart.on('dataZoom', debounce(function(param) {{
+                        const option = chart.getOption();
+                        const dataZoom = option.dataZoom[0]; // 获取 slider 的 dataZoom 配置
+                        chartDoms.forEach((otherChart, otherIndex) => {{
+                            if (otherIndex !== index) {{
+                                otherChart.setOption({{
+                                    dataZoom: [
+                                        {{ start: dataZoom.start, end: dataZoom.end }},
+                                        {{ start: dataZoom.start, end: dataZoom.end }}
+                                    ]
+                                }});
+                            }}
+                        }});
+                    }}, 100));
+                }});
+            }}
+            renderCharts({json.dumps(report, ensure_ascii=False, separators=(",", ":"))});
+            {live_js}
         </script>
     </body>
     </html>
     """
 
+    return html_content
+
+
+def gen_report(bench_config=None, echarts_js=None):
+    bench_results, adaptive_results, metrics_results = result_files(bench_config)
+    endpoint_serverinfo = (
+        get_server_info(bench_config) if bench_config else cached_server_info()
+    )
+    store = ResultStore()
+    store.update(bench_results)
+    metrics_store = ResultStore()
+    metrics_store.update(metrics_results)
+    system_info = report_system_info(
+        bench_config, endpoint_serverinfo, adaptive_results, get_env_info()
+    )
+    report = build_charts(store.rows(), bench_config, metrics_rows=metrics_store.rows())
+    html_content = render_report(system_info, report, echarts_js=echarts_js)
+
     # 将 HTML 写入文件
     with open("bubble_bench_report.html", "w") as f:
         f.write(html_content)
     print("BubbleBenchmarking report generated: bubble_bench_report.html")
 
 
+def serve_live(
+    address, bench_config=None, stop_event=None, poll_interval=1.0, echarts_js=None
+):
+    """实时报告服务：/ 返回当前的报告页面，/events 以 SSE 推送更新后的图表。后台轮询结果文件，只解析新追加的结果。
+    stop_event 为 None 时一直运行到 Ctrl-C，否则在 stop_event 置位后推送最终结果并退出"""
+    host, port = (
+        parse_address(address) if ":" in address else ("127.0.0.1", int(address))
+    )
+    env_info = get_env_info()
+    endpoint_serverinfo = (
+        get_server_info(bench_config) if bench_config else cached_server_info()
+    )
+    store = ResultStore()
+    metrics_store = ResultStore()
+    sample_cache = {}
+    cond = threading.Condition()
+    state = {"version": 0, "report": None, "html": None, "done": False}
+    adaptive_state = {}
+
+    def refresh():
+        bench_results, adaptive_results, metrics_results = result_files(bench_config)
+        adaptive_key = sorted(
+            (file, os.path.getmtime(file)) for file in adaptive_results
+        )
+        changed = store.update(bench_results)
+        changed = metrics_store.update(metrics_results) or changed
+        if (
+            not changed
+            and state["html"] is not None
+            and adaptive_state.get("key") == adaptive_key
+        ):
+            return
+        adaptive_state["key"] = adaptive_key
+        try:
+            report = build_charts(
+                store.rows(), bench_config, sample_cache, metrics_store.rows()
+            )
+        except ValueError:
+            # 还没有可以绘图的压测结果
+            report = {"charts": [], "bubble_count": 0, "datasets": []}
+        system_info = report_system_info(
+            bench_config, endpoint_serverinfo, adaptive_results, env_info
+        )
+        html_content = render_report(
+            system_info, report, live=True, echarts_js=echarts_js
+        )
+        with cond:
+            state["version"] += 1
+            state["report"] = json.dumps(
+                {"system_info": system_info, **report},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            state["html"] = html_content
+            cond.notify_all()
+
+    class LiveHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/":
+                with cond:
+                    body = state["html"].encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path == "/events":
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                # 连接后先推送一次当前结果，避免错过页面加载和连接之间的更新
+                version = -1
+                try:
+                    while True:
+                        with cond:
+                            cond.wait_for(
+                                lambda: state["version"] != version or state["done"],
+                                timeout=15,
+                            )
+                            updated = state["version"] != version
+                            version = state["version"]
+                            report = state["report"]
+                            done = state["done"]
+                        if updated:
+                            self.wfile.write(f"data: {report}\n\n".encode())
+                        elif done:
+                            self.wfile.write(b"event: done\ndata: {}\n\n")
+                            self.wfile.flush()
+                            break
+                        else:
+                            self.wfile.write(b": keepalive\n\n")
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            # 不打印访问日志，以免打乱压测进度条
+            pass
+
+    refresh()
+    server = ThreadingHTTPServer((host, port), LiveHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(
+        f"BubbleBenchmarking live report: http://{host}:{server.server_port}/",
+        flush=True,
+    )
+    if stop_event is None:
+        stop_event = threading.Event()
+    try:
+        while not stop_event.wait(poll_interval):
+            refresh()
+    except KeyboardInterrupt:
+        pass
+    refresh()
+    with cond:
+        state["done"] = True
+        cond.notify_all()
+    # 给 SSE 连接留一点时间推送最终结果
+    time.sleep(0.5)
+    server.shutdown()
+
+
 def main(args):
     config_str = DEFAULT_CONFIG_JSON
     if args.config:
@@ -686,19 +3371,47 @@ def main(args):
     # 过滤掉整行注释
     json_str = re.sub(r"(?m)^\s*//.*\n", "", config_str)
 
+    if args.worker:
+        return serve_worker(args.worker, args.authkey)
     if args.print_config:
         print(config_str)
         return 0
     elif args.gen_report:
+        if args.live:
+            return serve_live(
+                args.live,
+                json.loads(json_str) if args.config else None,
+                echarts_js=args.echarts_js,
+            )
         if args.config:
             config = json.loads(json_str)
-            return gen_report(config)
+            gen_report(config, args.echarts_js)
+            if args.compare:
+                return compare_config_results(config, args.compare)
         else:
-            return gen_report()
+            gen_report(echarts_js=args.echarts_js)
+            if args.compare:
+                return compare_results("bubble_bench.db", args.compare)
+        return 0
 
     config = json.loads(json_str)
+    if args.live:
+        # 实时报告服务在独立进程中轮询结果文件，压测结束后推送最终结果并退出
+        stop_event = Event()
+        live = Process(
+            target=serve_live,
+            args=(args.live, config, stop_event),
+            kwargs={"echarts_js": args.echarts_js},
+        )
+        live.start()
     run_benchmark(config, args.jobs, args.verbose)
-    gen_report(config)
+    if args.live:
+        stop_event.set()
+        live.join()
+    gen_report(config, args.echarts_js)
+    if args.compare:
+        return compare_config_results(config, args.compare)
+    return 0
 
 
 if __name__ == "__main__":
@@ -732,5 +3445,39 @@ if __name__ == "__main__":
         action="store_true",
         help="Print verbose information",
     )
+    parser.add_argument(
+        "--live",
+        type=str,
+        metavar="[HOST:]PORT",
+        help="Serve a live report over HTTP that updates as each case finishes. "
+        "With -g, keep watching the results in current directory until interrupted.",
+    )
+    parser.add_argument(
+        "--echarts-js",
+        type=str,
+        metavar="PATH",
+        help="Inline this local echarts.min.js into the report instead of loading it from CDN, "
+        "so the report renders on hosts without internet access.",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        metavar="BASELINE",
+        help="Compare the latest sweep of each endpoint in the result database with BASELINE, "
+        "which is 'previous', a sweep id or a server version. Exit with 1 on significant regressions, "
+        "2 if there is no baseline to compare with.",
+    )
+    parser.add_argument(
+        "--worker",
+        type=str,
+        metavar="HOST:PORT",
+        help="Run as a distributed load generation worker listening on HOST:PORT.",
+    )
+    parser.add_argument(
+        "--authkey",
+        type=str,
+        default="bubble_bench",
+        help="Auth key shared by the distributed coordinator and workers.",
+    )
     args = parser.parse_args()
-    main(args)
+    sys.exit(main(args))
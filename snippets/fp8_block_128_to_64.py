@@ -1,69 +1,357 @@
 #!/bin/env python3
 import os
 import json
-from argparse import ArgumentParser
+import math
+import shutil
+import hashlib
+import struct
+from argparse import ArgumentParser, ArgumentTypeError
+from contextlib import nullcontext
 from glob import glob
+from multiprocessing import Pool
 from tqdm import tqdm
 import json
 
 import torch
-from safetensors.torch import load_file, save_file
-from huggingface_hub import snapshot_download
 
-def main(b128_path, b64_path, model_name="deepseek-ai/DeepSeek-R1"):
-    torch.set_default_dtype(torch.bfloat16)
+# safetensors dtype -> bytes per element
+DTYPE_SIZE = {
+    'BOOL': 1, 'U8': 1, 'I8': 1, 'F8_E4M3': 1, 'F8_E5M2': 1,
+    'U16': 2, 'I16': 2, 'F16': 2, 'BF16': 2,
+    'U32': 4, 'I32': 4, 'F32': 4,
+    'U64': 8, 'I64': 8, 'F64': 8,
+}
+# safetensors dtype -> torch dtype of tensors decoded by the regridder
+TORCH_DTYPE = {
+    'F8_E4M3': torch.float8_e4m3fn,
+    'F32': torch.float32,
+}
+# Converted shards of output dir, lets an interrupted conversion resume
+PROGRESS_MANIFEST = "convert_progress.json"
+# Chunk size of the read()/write() fallback of copy_range()
+COPY_CHUNK_SIZE = 64 << 20
+
+def read_safetensors_header(file_path):
+    '''Return (header, data_start) of .safetensors file, tensor data is not read'''
+    with open(file_path, 'rb') as f:
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len))
+    return header, 8 + header_len
+
+def copy_funcs_of(in_fd, out_fd):
+    '''Fallback chain of copy_range() from in_fd to out_fd, fastest first. Data stays in kernel
+    with copy_file_range() or sendfile(), read()/write() is the last resort. Build it once per
+    file, copy_range() drops unsupported functions so later tensors do not retry them.'''
+    def copy_file_range(offset, n):
+        return os.copy_file_range(in_fd, out_fd, n, offset)
+    def sendfile(offset, n):
+        return os.sendfile(out_fd, in_fd, offset, n)
+    def read_write(offset, n):
+        return os.write(out_fd, os.pread(in_fd, min(n, COPY_CHUNK_SIZE), offset))
+    copy_funcs = [read_write]
+    if hasattr(os, 'sendfile'):
+        copy_funcs.insert(0, sendfile)
+    if hasattr(os, 'copy_file_range'):
+        copy_funcs.insert(0, copy_file_range)
+    return copy_funcs
+
+def copy_range(copy_funcs, offset, count):
+    '''Copy count bytes at offset of the input file to the current position of the output
+    file with the first working function of copy_funcs (see copy_funcs_of())'''
+    while count > 0:
+        try:
+            n = copy_funcs[0](offset, count)
+        except OSError:
+            # Not supported by the kernel or filesystem (EXDEV, ENOSYS, EINVAL...), try next one
+            if len(copy_funcs) == 1:
+                raise
+            copy_funcs.pop(0)
+            continue
+        if n == 0:
+            raise EOFError(f'Unexpected end of file at offset {offset}')
+        offset += n
+        count -= n
+
+def positive_int(text):
+    '''argparse type of integers >= 1'''
+    value = int(text)
+    if value < 1:
+        raise ArgumentTypeError(f'{text} is not a positive integer')
+    return value
+
+def parse_block(text):
+    '''Parse block size "RxC" into [R, C]'''
+    rows, cols = text.lower().split('x')
+    return [int(rows), int(cols)]
+
+def check_block(src_block, dst_block):
+    '''Each axis must either split blocks (src divisible by dst) or merge them (dst divisible by src)'''
+    for src, dst in zip(src_block, dst_block):
+        if src % dst != 0 and dst % src != 0:
+            raise ValueError(f"Can not regrid block {src_block} to {dst_block}: {src} and {dst} are not divisible")
+
+def regrid_axis(scale, dim, length, src, dst):
+    '''Regrid block scales along dim of a weight with length elements. Splitting takes the
+    scale of the enclosing block, merging takes the max of the merged blocks.'''
+    new_len = math.ceil(length / dst)
+    if src % dst == 0:
+        index = torch.arange(new_len) * dst // src
+        return scale.index_select(dim, index)
+    group = dst // src
+    # Pad ragged edge with 0, scale_inv is positive so it never wins amax
+    pad_shape = list(scale.shape)
+    pad_shape[dim] = new_len * group - scale.shape[dim]
+    scale = torch.cat([scale, scale.new_zeros(pad_shape)], dim)
+    return scale.unflatten(dim, (new_len, group)).amax(dim + 1)
+
+def regrid_scale_inv(scale_inv, weight_shape, src_block, dst_block):
+    '''Regrid 2D scale_inv of src_block to dst_block, ragged edge blocks follow weight_shape'''
+    assert scale_inv.dim() == 2
+    assert list(scale_inv.shape) == [math.ceil(n / b) for n, b in zip(weight_shape, src_block)]
+    scale_inv = regrid_axis(scale_inv, 0, weight_shape[0], src_block[0], dst_block[0])
+    return regrid_axis(scale_inv, 1, weight_shape[1], src_block[1], dst_block[1])
+
+def block_to_elements(scale, shape, block):
+    '''Broadcast block scales to every element of a weight of shape'''
+    scale = scale.repeat_interleave(block[0], 0)[:shape[0]]
+    return scale.repeat_interleave(block[1], 1)[:, :shape[1]]
+
+def requant_weight(weight, scale_inv, new_scale_inv, src_block, dst_block):
+    '''Requantize FP8 weight to merged blocks, so that weight * scale_inv is unchanged.
+    Merged scale_inv is the max of its blocks, values only shrink and never overflow.'''
+    new_weight = weight.float()
+    new_weight.mul_(block_to_elements(scale_inv, weight.shape, src_block))
+    new_weight.div_(block_to_elements(new_scale_inv, weight.shape, dst_block))
+    return new_weight.to(weight.dtype)
+
+def read_tensor(file_path, header, data_start, name):
+    '''Read one tensor of .safetensors file into a CPU torch tensor'''
+    info = header[name]
+    begin, end = info['data_offsets']
+    with open(file_path, 'rb', buffering=0) as f:
+        data = os.pread(f.fileno(), end - begin, data_start + begin)
+    return torch.frombuffer(bytearray(data), dtype=TORCH_DTYPE[info['dtype']]).reshape(info['shape'])
+
+def convert_shard(safetensor_file, new_safetensor_file, src_block, dst_block, external_tensors=None):
+    '''Stream tensors of safetensor_file into new_safetensor_file one at a time, regridding
+    *_scale_inv (and requantizing their weights when blocks are merged) and copying data of
+    other tensors in kernel. external_tensors maps paired tensors living in other shards to
+    their files. Return number of regridded tensors.'''
+    header, data_start = read_safetensors_header(safetensor_file)
+    metadata = header.pop('__metadata__', None)
+    external_tensors = external_tensors or {}
+    requant = any(dst > src for src, dst in zip(src_block, dst_block))
+
+    def locate(name):
+        '''(file_path, header, data_start) of input tensor name, maybe in another shard'''
+        if name in header:
+            return safetensor_file, header, data_start
+        assert name in external_tensors, f"{name} is not found"
+        return (external_tensors[name], *read_safetensors_header(external_tensors[name]))
+
+    def new_scale_inv(scale_name):
+        weight_name = scale_name[:-len('_scale_inv')]
+        scale_inv = read_tensor(*locate(scale_name), scale_name)
+        _, weight_header, _ = locate(weight_name)
+        return regrid_scale_inv(scale_inv, weight_header[weight_name]['shape'], src_block, dst_block)
+
+    # Keep the data layout of the input shard
+    weight_names = sorted(header, key=lambda name: header[name]['data_offsets'][0])
+    new_header = {'__metadata__': metadata} if metadata is not None else {}
+    new_tensors = {}
+    offset = 0
+    for weight_name in weight_names:
+        info = header[weight_name]
+        shape = info['shape']
+        if weight_name.endswith('_scale_inv'):
+            assert info['dtype'] == 'F32'
+            print(f'Regridding: {weight_name=}')
+            new_tensors[weight_name] = new_scale_inv(weight_name)
+            shape = list(new_tensors[weight_name].shape)
+        elif requant and f"{weight_name}_scale_inv" in header.keys() | external_tensors.keys():
+            assert info['dtype'] == 'F8_E4M3'
+            scale_name = f"{weight_name}_scale_inv"
+            new_tensors[weight_name] = (scale_name, new_scale_inv(scale_name))
+        nbytes = math.prod(shape) * DTYPE_SIZE[info['dtype']]
+        new_header[weight_name] = {'dtype': info['dtype'], 'shape': shape, 'data_offsets': [offset, offset + nbytes]}
+        offset += nbytes
+    header_bytes = json.dumps(new_header, separators=(',', ':')).encode('utf-8')
+    # Data buffer is 8-byte aligned, pad the header with spaces like safetensors does
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    quant_count = 0
+    # Write to a temp file and rename it when complete, new_safetensor_file is never partial
+    tmp_safetensor_file = f"{new_safetensor_file}.tmp"
+    # fout is buffered so that every write() is complete, it is flushed before copy_range()
+    # writes tensor data by fd behind its back
+    with open(safetensor_file, 'rb', buffering=0) as fin, open(tmp_safetensor_file, 'wb') as fout:
+        copy_funcs = copy_funcs_of(fin.fileno(), fout.fileno())
+        fout.write(struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for weight_name in weight_names:
+            begin, end = header[weight_name]['data_offsets']
+            if weight_name.endswith('_scale_inv'):
+                quant_count += 1
+                fout.write(new_tensors.pop(weight_name).numpy().tobytes())
+            elif weight_name in new_tensors:
+                scale_name, scale_inv = new_tensors.pop(weight_name)
+                weight = read_tensor(safetensor_file, header, data_start, weight_name)
+                old_scale_inv = read_tensor(*locate(scale_name), scale_name)
+                new_weight = requant_weight(weight, old_scale_inv, scale_inv, src_block, dst_block)
+                fout.write(new_weight.view(torch.uint8).numpy().tobytes())
+            else:
+                fout.flush()
+                copy_range(copy_funcs, data_start + begin, end - begin)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_safetensor_file, new_safetensor_file)
+    return quant_count
+
+def shard_record(file_path):
+    '''Return {size, header_sha256} of .safetensors file. The header holds the shape and
+    offsets of every tensor, together with the size it identifies a converted shard cheaply.'''
+    with open(file_path, 'rb') as f:
+        header_len, = struct.unpack('<Q', f.read(8))
+        header_sha256 = hashlib.sha256(f.read(header_len)).hexdigest()
+    return {"size": os.path.getsize(file_path), "header_sha256": header_sha256}
+
+def load_progress(manifest_file):
+    '''Load progress manifest {file_name: record}, {} if there is none'''
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+def save_progress(manifest_file, progress):
+    '''Write progress manifest atomically'''
+    with open(f"{manifest_file}.tmp", "w") as f:
+        json.dump(progress, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_file}.tmp", manifest_file)
+
+def is_converted(safetensor_file, new_safetensor_file, record, dst_block):
+    '''Whether new_safetensor_file is a complete conversion of the current safetensor_file'''
+    if record is None or record.get("block") != dst_block or not os.path.exists(new_safetensor_file):
+        return False
+    st = os.stat(safetensor_file)
+    if record["src_size"] != st.st_size or record["src_mtime_ns"] != st.st_mtime_ns:
+        return False
+    try:
+        return shard_record(new_safetensor_file) == {k: record[k] for k in ("size", "header_sha256")}
+    except (OSError, struct.error):
+        return False
+
+def convert_job(job):
+    '''Pool worker: convert one shard, return (file_name, progress record)'''
+    safetensor_file, new_safetensor_file, src_block, dst_block, external_tensors = job
+    st = os.stat(safetensor_file)
+    quant_count = convert_shard(safetensor_file, new_safetensor_file, src_block, dst_block, external_tensors)
+    record = shard_record(new_safetensor_file)
+    record.update(src_size=st.st_size, src_mtime_ns=st.st_mtime_ns, block=dst_block, quant_count=quant_count)
+    return os.path.basename(new_safetensor_file), record
+
+def paired_tensors(names, tensor_files, safetensor_file, requant):
+    '''Tensors paired with names (weight of scale_inv, and scale_inv of weight when blocks
+    are merged) that live in other shards, {name: file}'''
+    external_tensors = {}
+    for name in names:
+        if name.endswith('_scale_inv'):
+            paired = name[:-len('_scale_inv')]
+        elif requant:
+            paired = f"{name}_scale_inv"
+        else:
+            continue
+        if tensor_files.get(paired, safetensor_file) != safetensor_file:
+            external_tensors[paired] = tensor_files[paired]
+    return external_tensors
+
+def copy_model_files(b128_path, b64_path):
+    '''Copy config, index, tokenizer and other non-safetensors files of the input checkpoint'''
+    for file_name in sorted(os.listdir(b128_path)):
+        file_path = os.path.join(b128_path, file_name)
+        if os.path.isfile(file_path) and not file_name.endswith(".safetensors"):
+            shutil.copy2(file_path, os.path.join(b64_path, file_name))
+
+def write_model_index(model_index_file, new_safetensor_files):
+    '''Regenerate weight_map and total_size of model index from the written shards'''
+    with open(model_index_file, "r") as f:
+        model_index = json.load(f)
+    weight_map = {}
+    total_size = 0
+    for new_safetensor_file in new_safetensor_files:
+        header, _ = read_safetensors_header(new_safetensor_file)
+        header.pop('__metadata__', None)
+        for weight_name, info in header.items():
+            weight_map[weight_name] = os.path.basename(new_safetensor_file)
+            begin, end = info['data_offsets']
+            total_size += end - begin
+    model_index.setdefault("metadata", {})["total_size"] = total_size
+    model_index["weight_map"] = dict(sorted(weight_map.items()))
+    with open(model_index_file, "w", encoding="utf-8") as f:
+        json.dump(model_index, f, indent=2)
+    print(f"model index regenerated and saved to {model_index_file}")
+
+def main(b128_path, b64_path, model_name="deepseek-ai/DeepSeek-R1", jobs=1, dst_block=(64, 64), offline=False):
+    dst_block = list(dst_block)
+    src_block = [128, 128]
+    src_config_file = os.path.join(b128_path, "config.json")
+    if os.path.exists(src_config_file):
+        with open(src_config_file, "r") as f:
+            src_block = json.load(f)["quantization_config"]["weight_block_size"]
+    check_block(src_block, dst_block)
     os.makedirs(b64_path, exist_ok=True)
     model_index_file = os.path.join(b64_path, "model.safetensors.index.json")
     config_file = os.path.join(b64_path, "config.json")
      
     if not os.path.exists(model_index_file) or not os.path.exists(config_file):
-        snapshot_download(
-            repo_id=model_name,
-            ignore_patterns=["*.safetensors"],
-            local_dir=b64_path,
-            local_dir_use_symlinks=False
-        )
-        print(f"model index file and config file downloaded to {b64_path}")
-
-        # modify config.json and save it
-        config = json.load(open(config_file))
-        # modify block size from 128x128 to 64x64
-        quant_config = config["quantization_config"]
-        quant_config["weight_block_size"] = [
-            64,
-            64
-        ]
-        with open(config_file, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2, ensure_ascii=False, sort_keys=True)
-        print(f"config.json modified and saved to {config_file}")
+        if offline:
+            copy_model_files(b128_path, b64_path)
+            print(f"model index file and config file copied from {b128_path} to {b64_path}")
+        else:
+            from huggingface_hub import snapshot_download
+            snapshot_download(
+                repo_id=model_name,
+                ignore_patterns=["*.safetensors"],
+                local_dir=b64_path,
+                local_dir_use_symlinks=False
+            )
+            print(f"model index file and config file downloaded to {b64_path}")
+
+    # modify config.json and save it, also when the output dir already exists: a re-run with
+    # another --target-block reconverts the shards, config.json must follow
+    config = json.load(open(config_file))
+    # modify block size, e.g. from 128x128 to 64x64
+    quant_config = config["quantization_config"]
+    quant_config["weight_block_size"] = dst_block
+    with open(config_file, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, ensure_ascii=False, sort_keys=True)
+    print(f"config.json modified and saved to {config_file}")
 
-    with open(model_index_file, "r") as f:
-        model_index = json.load(f)
-    weight_map = model_index["weight_map"]
-    
     safetensor_files = list(glob(os.path.join(b128_path, "*.safetensors")))
     safetensor_files.sort()
-    safetensor_files = safetensor_files[130:]
-    quant_count = 0
-    for safetensor_file in tqdm(safetensor_files):
+    # A weight and its scale_inv may be saved in different shards
+    shard_tensors = {f: read_safetensors_header(f)[0].keys() - {'__metadata__'} for f in safetensor_files}
+    tensor_files = {name: f for f, names in shard_tensors.items() for name in names}
+    requant = any(dst > src for src, dst in zip(src_block, dst_block))
+    manifest_file = os.path.join(b64_path, PROGRESS_MANIFEST)
+    progress = load_progress(manifest_file)
+    convert_jobs = []
+    for safetensor_file in safetensor_files:
         file_name = os.path.basename(safetensor_file)
-        state_dict = load_file(safetensor_file, device="cuda")
-        new_state_dict = {}
-        for weight_name, weight in state_dict.items():
-            scale_inv_name = f"{weight_name}_scale_inv"
-            if weight_name.endswith('_scale_inv'):
-                print(f'Expanding: {weight_name=}')
-                assert weight.element_size() == 4
-                assert weight.dim() == 2
-                quant_count += 1
-                expand_weight = torch.repeat_interleave(weight, repeats=2, dim=0)
-                expand_weight = torch.repeat_interleave(expand_weight, repeats=2, dim=1)
-                new_state_dict[weight_name] = expand_weight
-            else:
-                new_state_dict[weight_name] = weight
         new_safetensor_file = os.path.join(b64_path, file_name)
-        save_file(new_state_dict, new_safetensor_file)
-    print(f"{quant_count} weights are expanded to block 64x64.")
+        if not is_converted(safetensor_file, new_safetensor_file, progress.get(file_name), dst_block):
+            progress.pop(file_name, None)
+            external_tensors = paired_tensors(shard_tensors[safetensor_file], tensor_files, safetensor_file, requant)
+            convert_jobs.append((safetensor_file, new_safetensor_file, src_block, dst_block, external_tensors))
+    if len(convert_jobs) < len(safetensor_files):
+        print(f"{len(safetensor_files) - len(convert_jobs)} shards are already converted, skipped.")
+    # A pool only pays off for more than one shard to convert in parallel, otherwise convert inline
+    with Pool(processes=jobs) if jobs > 1 and len(convert_jobs) > 1 else nullcontext() as pool:
+        results = pool.imap_unordered(convert_job, convert_jobs) if pool else map(convert_job, convert_jobs)
+        for file_name, record in tqdm(results, total=len(convert_jobs)):
+            progress[file_name] = record
+            save_progress(manifest_file, progress)
+    write_model_index(model_index_file, [os.path.join(b64_path, os.path.basename(f)) for f in safetensor_files])
+    quant_count = sum(record["quant_count"] for record in progress.values())
+    print(f"{quant_count} weights are regridded from block {src_block[0]}x{src_block[1]} to {dst_block[0]}x{dst_block[1]}.")
 
 
 if __name__ == "__main__":
@@ -71,6 +359,11 @@ if __name__ == "__main__":
     parser.add_argument("--input-b128-hf-path", '-i', type=str, required=True)
     parser.add_argument("--output-b64-hf-path", '-o', type=str, required=True)
     parser.add_argument("--model-name", type=str, default="deepseek-ai/DeepSeek-R1")
+    parser.add_argument("--jobs", '-j', type=positive_int, default=1, help="Number of shards to convert in parallel")
+    parser.add_argument("--target-block", type=parse_block, default=[64, 64],
+                        help="Target block size RxC of scale_inv, e.g. 64x64, 128x32 or 128x128 (default: 64x64)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Copy index, config and other files from the input path instead of downloading them")
     args = parser.parse_args()
-    main(args.input_b128_hf_path, args.output_b64_hf_path, args.model_name)
+    main(args.input_b128_hf_path, args.output_b64_hf_path, args.model_name, args.jobs, args.target_block, args.offline)
     print("done")
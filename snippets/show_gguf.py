@@ -1,39 +1,75 @@
 #!/usr/bin/env python3
 import os
 import argparse
-import torch
+from functools import partial
+from multiprocessing import Pool
 
 from gguf import GGUFReader, GGUFValueType, ReaderTensor
 
-def print_tensor_tsv(model_dir, depth):
+from tensor_inventory import cache_file_path, scan_files, PrefixTree, print_summary, positive_int, print_footprint
+
+# Bump when the cached rows change
+CACHE_VERSION = 2
+
+def scan_file(model_dir, filename):
+    '''Scan one .gguf file, return (filename, rows)'''
+    file_path = os.path.join(model_dir, filename)
+    reader = GGUFReader(file_path, 'r')
+    rows = [(tensor.name, int(tensor.n_elements), tensor.tensor_type.name, str(tensor.shape),
+             int(tensor.n_bytes))
+            for tensor in reader.tensors]
+    return filename, rows
+
+def footprint_class(name):
+    '''Footprint class of GGUF tensor: 0 routed expert, 1 TP sharded, 2 replicated on every GPU'''
+    if '_exps.' in name:
+        return 0
+    # Norms, biases and MoE router are small and replicated
+    if 'norm' in name or name.endswith('bias') or 'ffn_gate_inp' in name or 'exp_probs_b' in name:
+        return 2
+    return 1
+
+def print_tensor_tsv(model_dir, depth, jobs=1, use_cache=True, summary_dtype=False, show_bytes=False,
+                     tp=None, ep=1):
     '''Print tensor info in .safetensors into tsv format'''
+    # Footprint rows are bytes, print them in the TensorBytes column
+    show_bytes = show_bytes or tp is not None
     TENSOR_CLASS = {
         'weight': 'weight',
         'bias': 'weight',
         'weight_scale_inv': 'scale'
     }
-    print('SafetensorsFile\tTensorKey\tTensorParams\tTensorType\tTensorShape')
+    print('SafetensorsFile\tTensorKey\tTensorParams\tTensorType\tTensorShape' + ('\tTensorBytes' if show_bytes else ''))
     safetensor_files = sorted([f for f in os.listdir(model_dir) if f.endswith('.gguf')])
-    summary = {}
-    for filename in safetensor_files:
-        file_path = os.path.join(model_dir, filename)
-        reader = GGUFReader(file_path, 'r')
-        for n, tensor in enumerate(reader.tensors, 1):
-            print(f'{filename}\t{tensor.name}\t{tensor.n_elements}\t{tensor.tensor_type.name}\t{tensor.shape}')
-            lst = tensor.name.split('.')
+    scan = partial(scan_file, model_dir)
+    summary = PrefixTree(depth)
+    footprint = [0, 0, 0]
+    cache_path = cache_file_path('show_gguf', model_dir) if use_cache else None
+    # Parsing GGUF metadata is CPU bound in python, so use processes
+    for filename, rows in scan_files(model_dir, safetensor_files, scan, Pool, cache_path, CACHE_VERSION, jobs):
+        for name, n_elements, type_name, shape, n_bytes in rows:
+            print(f'{filename}\t{name}\t{n_elements}\t{type_name}\t{shape}' + (f'\t{n_bytes}' if show_bytes else ''))
+            lst = name.split('.')
             # Get suffix: .weight or .weight_scale_inv
             tclass = TENSOR_CLASS[lst[-1]] if lst[-1] in TENSOR_CLASS else lst[-1]
-            # Limit prefix to dep
-            dep = min(len(lst), depth+1) if depth > 0 else len(lst)
-            # Get summary of prefixes
-            for prefix in ['.'.join(lst[:i]) for i in range(0, dep)]:
-                summary[f'{tclass}[{prefix}]'] = summary.get(f'{tclass}[{prefix}]', 0) + tensor.n_elements
-    for key in sorted(summary):
-        print(f'Summary\t{key}\t{summary[key]}\t\t')
+            summary.add(lst, tclass, n_elements, type_name, n_bytes)
+            footprint[footprint_class(name)] += n_bytes
+    print_summary(summary, summary_dtype, show_bytes)
+    if tp is not None:
+        print_footprint(footprint, tp, ep)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Print tensor shape and dtype of .gguf file')
     parser.add_argument('model_dir', nargs='?', default='.', help='Model directory (default: $PWD)')
     parser.add_argument('--summary_depth', '-d', type=int, default=3, help='Summary depth of weights')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of files to scan concurrently')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Do not read or write the inventory cache in $XDG_CACHE_HOME/show_gguf')
+    parser.add_argument('--summary_dtype', action='store_true', help='Also print params of each dtype per summary prefix')
+    parser.add_argument('--bytes', action='store_true', help='Add TensorBytes column of storage bytes to tensors and summaries')
+    parser.add_argument('--tp', type=positive_int, default=None,
+                        help='Print projected per-GPU bytes for this TP size, implies --bytes (default: off)')
+    parser.add_argument('--ep', type=positive_int, default=1, help='EP size of routed experts for the per-GPU projection')
     args = parser.parse_args()
-    print_tensor_tsv(args.model_dir, args.summary_depth)
+    print_tensor_tsv(args.model_dir, args.summary_depth, args.jobs, not args.no_cache,
+                     args.summary_dtype, args.bytes, args.tp, args.ep)
@@ -1,39 +1,117 @@
 #!/usr/bin/env python3
 import os
+import json
+import math
+import struct
 import argparse
-import torch
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
-from safetensors import safe_open
+from tensor_inventory import cache_file_path, scan_files, PrefixTree, print_summary, positive_int, print_footprint
 
-def print_tensor_tsv(model_dir, depth):
+# safetensors dtype -> str(torch.dtype), keeps header-only output identical to get_tensor()
+SAFETENSORS_DTYPE = {
+    'BOOL': 'torch.bool',
+    'U8': 'torch.uint8',
+    'I8': 'torch.int8',
+    'U16': 'torch.uint16',
+    'I16': 'torch.int16',
+    'U32': 'torch.uint32',
+    'I32': 'torch.int32',
+    'U64': 'torch.uint64',
+    'I64': 'torch.int64',
+    'F8_E4M3': 'torch.float8_e4m3fn',
+    'F8_E5M2': 'torch.float8_e5m2',
+    'F16': 'torch.float16',
+    'BF16': 'torch.bfloat16',
+    'F32': 'torch.float32',
+    'F64': 'torch.float64',
+}
+
+# Bump when the cached rows change
+CACHE_VERSION = 2
+
+def read_safetensors_header(file_path):
+    '''Read the JSON header of .safetensors file, tensor data is not touched'''
+    with open(file_path, 'rb') as f:
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len))
+    header.pop('__metadata__', None)
+    return header
+
+def scan_tensors(file_path, load_tensors=False):
+    '''Yield (key, numel, dtype, shape, nbytes) of tensors in .safetensors file, ordered by key'''
+    if load_tensors:
+        from safetensors import safe_open
+        with safe_open(file_path, framework='pt') as f:
+            for key in f.keys():
+                tensor = f.get_tensor(key)
+                yield key, tensor.numel(), str(tensor.dtype), str(tensor.shape), tensor.nbytes
+        return
+    header = read_safetensors_header(file_path)
+    # safe_open().keys() is sorted, so is the header-only scan
+    for key in sorted(header):
+        shape = header[key]['shape']
+        dtype = header[key]['dtype']
+        begin, end = header[key]['data_offsets']
+        yield key, math.prod(shape), SAFETENSORS_DTYPE.get(dtype, dtype), f'torch.Size({shape})', end - begin
+
+def scan_file(model_dir, filename, load_tensors=False):
+    '''Scan one .safetensors file, return (filename, rows)'''
+    file_path = os.path.join(model_dir, filename)
+    return filename, list(scan_tensors(file_path, load_tensors))
+
+def footprint_class(key):
+    '''Footprint class of HF tensor: 0 routed expert, 1 TP sharded, 2 replicated on every GPU'''
+    if '.experts.' in key:
+        return 0
+    # Norms, biases and MoE router are small and replicated
+    if 'norm' in key or key.endswith('bias') or key.endswith('mlp.gate.weight'):
+        return 2
+    return 1
+
+def print_tensor_tsv(model_dir, depth, load_tensors=False, jobs=1, use_cache=True,
+                     summary_dtype=False, show_bytes=False, tp=None, ep=1):
     '''Print tensor info in .safetensors into tsv format'''
+    # Footprint rows are bytes, print them in the TensorBytes column
+    show_bytes = show_bytes or tp is not None
     TENSOR_CLASS = {
         'weight_scale_inv': 'scale',
         'weight_scale': 'scale'
     }
-    print('SafetensorsFile\tTensorKey\tTensorParams\tTensorType\tTensorShape')
+    print('SafetensorsFile\tTensorKey\tTensorParams\tTensorType\tTensorShape' + ('\tTensorBytes' if show_bytes else ''))
     safetensor_files = sorted([f for f in os.listdir(model_dir) if f.endswith('.safetensors')])
-    summary = {}
-    for filename in safetensor_files:
-        file_path = os.path.join(model_dir, filename)
-        with safe_open(file_path, framework='pt') as f:
-            for key in f.keys():
-                tensor = f.get_tensor(key)
-                print(f'{filename}\t{key}\t{tensor.numel()}\t{tensor.dtype}\t{tensor.shape}')
-                lst = key.split('.')
-                # Get suffix: .weight or .weight_scale_inv
-                tclass = TENSOR_CLASS[lst[-1]] if lst[-1] in TENSOR_CLASS else 'weight'
-                # Limit prefix to dep
-                dep = min(len(lst), depth+1) if depth > 0 else len(lst)
-                # Get summary of prefixes
-                for prefix in ['.'.join(lst[:i]) for i in range(0, dep)]:
-                    summary[f'{tclass}[{prefix}]'] = summary.get(f'{tclass}[{prefix}]', 0) + tensor.numel()
-    for key in sorted(summary):
-        print(f'Summary\t{key}\t{summary[key]}\t\t')
+    scan = partial(scan_file, model_dir, load_tensors=load_tensors)
+    summary = PrefixTree(depth)
+    footprint = [0, 0, 0]
+    cache_path = cache_file_path('show_safetensors', model_dir) if use_cache else None
+    # Scanning is I/O bound, threads are enough
+    for filename, rows in scan_files(model_dir, safetensor_files, scan, ThreadPool, cache_path, CACHE_VERSION, jobs):
+        for key, numel, dtype, shape, nbytes in rows:
+            print(f'{filename}\t{key}\t{numel}\t{dtype}\t{shape}' + (f'\t{nbytes}' if show_bytes else ''))
+            lst = key.split('.')
+            # Get suffix: .weight or .weight_scale_inv
+            tclass = TENSOR_CLASS[lst[-1]] if lst[-1] in TENSOR_CLASS else 'weight'
+            summary.add(lst, tclass, numel, dtype, nbytes)
+            footprint[footprint_class(key)] += nbytes
+    print_summary(summary, summary_dtype, show_bytes)
+    if tp is not None:
+        print_footprint(footprint, tp, ep)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Print tensor shape and dtype of .safetensors file')
     parser.add_argument('model_dir', nargs='?', default='.', help='Model directory (default: $PWD)')
     parser.add_argument('--summary_depth', '-d', type=int, default=3, help='Summary depth of weights')
+    parser.add_argument('--load_tensors', action='store_true',
+                        help='Load every tensor with safetensors/torch instead of parsing file headers only (slow)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of files to scan concurrently')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Do not read or write the inventory cache in $XDG_CACHE_HOME/show_safetensors')
+    parser.add_argument('--summary_dtype', action='store_true', help='Also print params of each dtype per summary prefix')
+    parser.add_argument('--bytes', action='store_true', help='Add TensorBytes column of storage bytes to tensors and summaries')
+    parser.add_argument('--tp', type=positive_int, default=None,
+                        help='Print projected per-GPU bytes for this TP size, implies --bytes (default: off)')
+    parser.add_argument('--ep', type=positive_int, default=1, help='EP size of routed experts for the per-GPU projection')
     args = parser.parse_args()
-    print_tensor_tsv(args.model_dir, args.summary_depth)
+    print_tensor_tsv(args.model_dir, args.summary_depth, args.load_tensors, args.jobs, not args.no_cache,
+                     args.summary_dtype, args.bytes, args.tp, args.ep)
@@ -0,0 +1,135 @@
+'''Tensor inventory helpers shared by show_safetensors.py and show_gguf.py'''
+import os
+import sys
+import json
+import hashlib
+import math
+import argparse
+from contextlib import nullcontext
+
+def cache_file_path(tool, model_dir):
+    '''Inventory cache of model_dir: $XDG_CACHE_HOME/<tool>/<sha1 of abspath>.json'''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    name = hashlib.sha1(os.path.abspath(model_dir).encode()).hexdigest()
+    return os.path.join(cache_home, tool, f'{name}.json')
+
+def load_cache(cache_path, version):
+    '''Load inventory cache {filename: {size, mtime_ns, rows}}, {} if missing or broken'''
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        return cache['files'] if cache.get('version') == version else {}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def save_cache(cache_path, version, files):
+    '''Write inventory cache atomically, a failed write only costs a rescan next time'''
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version, 'files': files}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f'Warning: failed to write cache {cache_path}: {e}', file=sys.stderr)
+
+def scan_files(model_dir, filenames, scan, pool_class, cache_path=None, cache_version=0, jobs=1):
+    '''Return [(filename, rows)] in the order of filenames, only files changed since
+    the cached scan (by size and mtime) are scanned again. pool_class is ThreadPool or Pool,
+    scan runs in it when jobs > 1, and the cache is not used if cache_path is None'''
+    cache = load_cache(cache_path, cache_version) if cache_path else {}
+    files = {}
+    stale = []
+    for filename in filenames:
+        st = os.stat(os.path.join(model_dir, filename))
+        entry = cache.get(filename)
+        if entry is None or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'rows': None}
+            stale.append(filename)
+        files[filename] = entry
+    # imap() keeps the order of stale files, so the output is the same as the serial path
+    with pool_class(jobs) if jobs > 1 and len(stale) > 1 else nullcontext() as pool:
+        for filename, rows in pool.imap(scan, stale) if pool else map(scan, stale):
+            files[filename]['rows'] = rows
+    if cache_path and (stale or len(files) != len(cache)):
+        save_cache(cache_path, cache_version, files)
+    return [(filename, [tuple(row) for row in files[filename]['rows']]) for filename in filenames]
+
+class PrefixTree:
+    '''Prefix tree of dotted tensor names, aggregates params, bytes and per-dtype params
+    of every (node, tensor class) in one pass, without building prefix strings per tensor'''
+    def __init__(self, depth):
+        self.depth = depth
+        # node: [children {name component: node}, totals {tclass: [params, bytes, {dtype: [params, bytes]}]}]
+        self.root = [{}, {}]
+
+    def add(self, lst, tclass, numel, dtype, nbytes):
+        '''Add tensor with splitted name lst to root and its first (depth - 1) prefixes'''
+        # Limit prefix to dep
+        dep = min(len(lst), self.depth+1) if self.depth > 0 else len(lst)
+        node = self.root
+        for i in range(dep):
+            if i > 0:
+                node = node[0].setdefault(lst[i-1], [{}, {}])
+            totals = node[1].get(tclass)
+            if totals is None:
+                totals = node[1][tclass] = [0, 0, {}]
+            totals[0] += numel
+            totals[1] += nbytes
+            dtype_totals = totals[2].get(dtype)
+            if dtype_totals is None:
+                dtype_totals = totals[2][dtype] = [0, 0]
+            dtype_totals[0] += numel
+            dtype_totals[1] += nbytes
+
+    def items(self):
+        '''Return [(f'{tclass}[{prefix}]', params, bytes, {dtype: [params, bytes]})] sorted by key'''
+        items = {}
+        stack = [('', self.root)]
+        while stack:
+            prefix, node = stack.pop()
+            children, totals = node
+            for tclass, (params, nbytes, dtypes) in totals.items():
+                key = f'{tclass}[{prefix}]'
+                if key not in items:
+                    items[key] = (key, params, nbytes, dtypes)
+                    continue
+                # A name starting with an empty component ('.a.weight') gives a child of root
+                # with the same prefix as root, sum them up like the flat prefix dict did
+                _, old_params, old_nbytes, old_dtypes = items[key]
+                merged = {dtype: list(dtype_totals) for dtype, dtype_totals in old_dtypes.items()}
+                for dtype, (dtype_params, dtype_bytes) in dtypes.items():
+                    dtype_totals = merged.setdefault(dtype, [0, 0])
+                    dtype_totals[0] += dtype_params
+                    dtype_totals[1] += dtype_bytes
+                items[key] = (key, old_params + params, old_nbytes + nbytes, merged)
+            for name, child in children.items():
+                # Empty components are kept: the child '' of prefix '' is '.', not ''
+                stack.append((f'{prefix}.{name}' if node is not self.root else name, child))
+        return [items[key] for key in sorted(items)]
+
+def print_summary(summary, summary_dtype=False, show_bytes=False):
+    '''Print Summary rows of PrefixTree, and optionally per-dtype params of prefixes'''
+    for key, params, nbytes, dtypes in summary.items():
+        print(f'Summary\t{key}\t{params}\t\t' + (f'\t{nbytes}' if show_bytes else ''))
+        if summary_dtype:
+            for dtype in sorted(dtypes):
+                dtype_params, dtype_bytes = dtypes[dtype]
+                print(f'SummaryDtype\t{key}\t{dtype_params}\t{dtype}\t' + (f'\t{dtype_bytes}' if show_bytes else ''))
+
+def positive_int(text):
+    '''argparse type of integers >= 1'''
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'{text} is not a positive integer')
+    return value
+
+def print_footprint(footprint, tp, ep):
+    '''Print projected per-GPU bytes: routed experts split by EP, other matrices by TP'''
+    expert = math.ceil(footprint[0] / ep)
+    sharded = math.ceil(footprint[1] / tp)
+    replicated = footprint[2]
+    print(f'Footprint\texpert[ep={ep}]\t\t\t\t{expert}')
+    print(f'Footprint\tsharded[tp={tp}]\t\t\t\t{sharded}')
+    print(f'Footprint\treplicated[]\t\t\t\t{replicated}')
+    print(f'Footprint\tper_gpu[tp={tp},ep={ep}]\t\t\t\t{expert + sharded + replicated}')